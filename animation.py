@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 import mpl_toolkits.mplot3d.axes3d as p3
 from matplotlib import animation
 import numpy as np
+from utils import neighbour_tools as nbr_tools
 plt.rcParams['animation.ffmpeg_path'] = '/usr/local/bin/ffmpeg' #my add - this path needs to be added
 Writer = animation.writers['ffmpeg']
 writer = Writer(fps=15, metadata=dict(artist='Me'), bitrate=1800)
@@ -233,59 +234,23 @@ def animateMe(Ts, t_all, states_all, cmds_all, targets_all, obstacles_all, walls
         
         r_ = 5.1
         
+        # by default, each agent links only to itself
+        x_lat[:,:] = pos[0,:]
+        y_lat[:,:] = pos[1,:]
+        z_lat[:,:] = pos[2,:]
+        
+        # link each agent to its neighbours (found with the spatial index)
+        i_lat, j_lat = nbr_tools.build_pairs(pos, r_)
+        x_lat[2*j_lat+1,i_lat] = pos[0,j_lat]
+        y_lat[2*j_lat+1,i_lat] = pos[1,j_lat]
+        z_lat[2*j_lat+1,i_lat] = pos[2,j_lat]
+        x_lat[2*i_lat+1,j_lat] = pos[0,i_lat]
+        y_lat[2*i_lat+1,j_lat] = pos[1,i_lat]
+        z_lat[2*i_lat+1,j_lat] = pos[2,i_lat]
+        
         for j in range (0, nVeh):
         
             temp_lat = lattices[j]
-            
-            # do this upfront, rather than in
-            #x_lat[0::2,:] = pos[0,:]
-            #x_lat[1::2,:] = pos[0,:]
-            #y_lat[0::2,:] = pos[1,:]
-            #y_lat[1::2,:] = pos[1,:]
-            #z_lat[0::2,:] = pos[2,:]
-            #z_lat[1::2,:] = pos[2,:]
-            
-        
-            # search through each neighbour
-            #for k_neigh in range(pos.shape[1]):
-            for k_neigh in range(0,nVeh):
-                
-                dist = 1000
-                # except for itself (duh):
-                if j != k_neigh:
-                    # compute the euc distance between them
-                    dist = np.linalg.norm(pos[:,j]-pos[:,k_neigh])
-                    # if it is within the interaction range
-                    if dist <= r_: 
-                        #x_lat[k_neigh,j] = pos[0,k_neigh]
-                        #y_lat[k_neigh,j] = pos[1,k_neigh]
-                        #z_lat[k_neigh,j] = pos[2,k_neigh]
-                        # first, itself
-                        x_lat[2*k_neigh,j] = pos[0,j]
-                        y_lat[2*k_neigh,j] = pos[1,j]
-                        z_lat[2*k_neigh,j] = pos[2,j]
-                        # then it's neighbour
-                        x_lat[2*k_neigh+1,j] = pos[0,k_neigh]
-                        y_lat[2*k_neigh+1,j] = pos[1,k_neigh]
-                        z_lat[2*k_neigh+1,j] = pos[2,k_neigh]
-                    else:
-                        #x_lat[k_neigh,j] = pos[0,j]
-                        #y_lat[k_neigh,j] = pos[1,j]
-                        #z_lat[k_neigh,j] = pos[2,j]
-                        x_lat[2*k_neigh:2*k_neigh+2,j] = pos[0,j]
-                        y_lat[2*k_neigh:2*k_neigh+2,j] = pos[1,j]
-                        z_lat[2*k_neigh:2*k_neigh+2,j] = pos[2,j]
-                        #print('too far')
-                else:
-                    #x_lat[k_neigh,j] = pos[0,j]
-                    #y_lat[k_neigh,j] = pos[1,j]
-                    #z_lat[k_neigh,j] = pos[2,j] 
-                    x_lat[2*k_neigh:2*k_neigh+2,j] = pos[0,j]
-                    y_lat[2*k_neigh:2*k_neigh+2,j] = pos[1,j]
-                    z_lat[2*k_neigh:2*k_neigh+2,j] = pos[2,j]  
-                    #print('myself')                                            
-                                                         
-            
             temp_lat.set_data(x_lat[:,j], y_lat[:,j])
             temp_lat.set_3d_properties(z_lat[:,j])  
         #temp_lat.set_data(x_lat[:,j], y_lat[:,j])
@@ -24,131 +24,165 @@ import numpy as np
 from utils import pinning_tools, reynolds_tools, saber_tools, lemni_tools, starling_tools  
 from utils import encirclement_tools as encircle_tools
 from utils import staticShapes_tools as statics
+from utils import neighbour_tools as nbr_tools
 
-#%% Tactic Command Equations 
-# ------------------------  
-def commands(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, tactic_type, centroid, params):   
-     
-    # initialize 
-    u_int = np.zeros((3,states_q.shape[1]))     # interactions
-    u_obs = np.zeros((3,states_q.shape[1]))     # obstacles 
-    u_nav = np.zeros((3,states_q.shape[1]))     # navigation
-    u_enc = np.zeros((3,states_q.shape[1]))     # encirclement 
-    u_statics = np.zeros((3,states_q.shape[1])) # statics
-    cmd_i = np.zeros((3,states_q.shape[1]))     # store the commands
-    pin_matrix = np.zeros((states_q.shape[1],states_q.shape[1])) # store pins 
-        
-    # if doing Reynolds, reorder the agents 
-    if tactic_type == 'reynolds':
-        distances = reynolds_tools.order(states_q)
-        
-    # if doing pinning control, select pins
-    if tactic_type == 'pinning':
-        #pin_matrix = pinning_tools.select_pins(states_q) 
-        #pin_matrix = pinning_tools.select_pins_components(states_q, 'gramian') 
-        pin_matrix = pinning_tools.select_pins_components(states_q) 
-        
-    # for each vehicle/node in the network
-    for k_node in range(states_q.shape[1]): 
-                 
-        # Reynolds Flocking
-        # ------------------
-        if tactic_type == 'reynolds':
-           
-           cmd_i[:,k_node] = reynolds_tools.compute_cmd(targets, centroid, states_q, states_p, k_node, distances)
-           
-           # steal obstacle avoidance term from saber
-           # ----------------------------------------
-           u_obs[:,k_node] = saber_tools.compute_cmd_b(states_q, states_p, obstacles, walls, k_node)
-        
-        
-        # Saber Flocking
-        # ---------------                                
-        if tactic_type == 'saber':
-               
-            # Lattice Flocking term (phi_alpha)
-            # ---------------------------------  
-            u_int[:,k_node] = saber_tools.compute_cmd_a(states_q, states_p, targets, targets_v, k_node)    
-        
-            # Navigation term (phi_gamma)
-            # ---------------------------
-            u_nav[:,k_node] = saber_tools.compute_cmd_g(states_q, states_p, targets, targets_v, k_node)
-                          
-            # Obstacle Avoidance term (phi_beta)
-            # ---------------------------------   
-            u_obs[:,k_node] = saber_tools.compute_cmd_b(states_q, states_p, obstacles, walls, k_node)
-
-        # Encirclement term (phi_delta)
-        # ---------------------------- 
-        if tactic_type == 'circle':       
-            
-            u_enc[:,k_node] = encircle_tools.compute_cmd(states_q, states_p, targets_enc, targets_v_enc, k_node)
-            
-            # steal obstacle avoidance term from saber
-            # ----------------------------------------
-            u_obs[:,k_node] = saber_tools.compute_cmd_b(states_q, states_p, obstacles, walls, k_node)
-                 
-        # Lemniscatic term (phi_lima)
-        # ---------------------------- 
-        if tactic_type == 'lemni':    
-            
-            u_enc[:,k_node] = lemni_tools.compute_cmd(states_q, states_p, targets_enc, targets_v_enc, k_node)
-            
-            # steal obstacle avoidance term from saber
-            # ----------------------------------------
-            u_obs[:,k_node] = saber_tools.compute_cmd_b(states_q, states_p, obstacles, walls, k_node)
-        
-        
-        if tactic_type == 'statics':
-            u_statics[:,k_node] = statics.compute_cmd(states_q, states_p, targets_enc, targets_v_enc, k_node)
-            
-            # steal obstacle avoidance term from saber
-            # ----------------------------------------
-            u_obs[:,k_node] = saber_tools.compute_cmd_b(states_q, states_p, obstacles, walls, k_node)
-                  
-        # Starling
-        # --------
-        if tactic_type == 'starling':
-           
-            # compute command 
-            cmd_i[:,k_node], params = starling_tools.compute_cmd(targets, centroid, states_q, states_p, k_node, params, 0.02)
-        
-        
-        # Pinning
-        # --------
-        if tactic_type == 'pinning':
-            
-            cmd_i[:,k_node] = pinning_tools.compute_cmd(centroid, states_q, states_p, obstacles, walls, targets, targets_v, k_node, pin_matrix)
-            
-            
-            
-        # Mixer
-        # -----         
-        if tactic_type == 'saber':
-            cmd_i[:,k_node] = u_int[:,k_node] + u_obs[:,k_node] + u_nav[:,k_node] 
-        elif tactic_type == 'reynolds':
-            cmd_i[:,k_node] = cmd_i[:,k_node] + u_obs[:,k_node] # adds the saber obstacle avoidance 
-        elif tactic_type == 'circle':
-            cmd_i[:,k_node] = u_obs[:,k_node] + u_enc[:,k_node] 
-        elif tactic_type == 'lemni':
-            cmd_i[:,k_node] = u_obs[:,k_node] + u_enc[:,k_node]
-        elif tactic_type == 'statics':
-            cmd_i[:,k_node] = u_obs[:,k_node] + u_statics[:,k_node]
-        elif tactic_type == 'starling':
-            cmd_i[:,k_node] = cmd_i[:,k_node]
-        elif tactic_type == 'pinning':
-            cmd_i[:,k_node] = cmd_i[:,k_node]
-            
-        # if using pinning control
-        # pin (agent 0) just does the u_nav part
-        # --------------------------------------
-        #cmd_i[:,0] = u_nav[:,0] 
-        
-
-    cmd = cmd_i    
+#%% Hyperparameters
+# -----------------
+interactions = 'pairs'  # how to compute lattice interactions 
+                            # dense = all pairwise tensors (N x N)
+                            # pairs = sparse neighbour list (CSR), only pairs in range
+neighbours = 'verlet'   # how to find neighbours for the sparse neighbour list
+                            # exact = search from scratch every step
+                            # verlet = Verlet list, only rebuilt when agents have moved far enough
+skin = 1                # extra range for Verlet list candidates (rebuilt after moving skin/2)
+
+verlet_lists = {}       # stores a Verlet list for each cutoff (persists between steps)
+saber_work = saber_tools.workspace()    # buffers for the fused saber controller (persist between steps)
+saber_cmd = saber_tools.workspace()     # output of the fused saber controller (persists between steps)
+zero_pins = {}          # stores an (empty) pin matrix for each swarm size (for tactics without pins)
+
+#%% Useful functions
+# ------------------
+
+# neighbour list (CSR) at cutoff r
+def neighbour_list(states_q, r):
+    if neighbours == 'verlet':
+        if r not in verlet_lists:
+            verlet_lists[r] = nbr_tools.verlet(r, skin)
+        return verlet_lists[r].update(states_q)
+    else:
+        return nbr_tools.neighbour_list(states_q, r)
+
+# pin matrix for tactics without pins (N x N zeros, shared, so read-only)
+def no_pins(nNodes):
+    if nNodes not in zero_pins:
+        zero_pins[nNodes] = np.zeros((nNodes,nNodes))
+        zero_pins[nNodes].setflags(write=False)
+    return zero_pins[nNodes]
+
+#%% Tactic kernels (whole swarm)
+# ------------------------------
+# note: each kernel computes the commands for all agents at once (3 x N), and 
+# returns them with the (updated) params and the pin matrix.
+# note: the commands from kernel_saber are borrowed (a buffer that is reused, 
+# i.e. overwritten by the next call), copy them to keep them longer than a step
+
+# Reynolds Flocking
+# -----------------
+def kernel_reynolds(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    # note: the cohesion ranges (if required) come from the same distances as the rest
+    cmd = reynolds_tools.compute_cmd_all(targets, centroid, states_q, states_p)
+    
+    # adds the saber obstacle avoidance 
+    cmd += saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls)
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Saber Flocking
+# --------------
+def kernel_saber(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    # fused lattice (phi_alpha), obstacle (phi_beta) and navigation (phi_gamma) terms
+    if interactions == 'pairs':
+        nbrs = neighbour_list(states_q, saber_tools.default_params.r)
+        cmd_i = saber_cmd.get('cmd', (3,states_q.shape[1]))
+        cmd = saber_tools.compute_cmd_all(states_q, states_p, obstacles, walls, targets, targets_v, nbrs, out = cmd_i, work = saber_work)
+    else:
+        u_int = saber_tools.compute_cmd_a_all(states_q, states_p)
+        u_obs = saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls)
+        u_nav = saber_tools.compute_cmd_g_all(states_q, states_p, targets, targets_v)
+        cmd = u_int + u_obs + u_nav
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Encirclement (phi_delta)
+# ------------------------
+def kernel_circle(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    u_enc = encircle_tools.compute_cmd_all(states_q, states_p, targets_enc, targets_v_enc)
+    
+    # note: obstacle avoidance term is stolen from saber
+    cmd = saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls) + u_enc
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Lemniscatic (phi_lima)
+# ----------------------
+def kernel_lemni(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    u_enc = lemni_tools.compute_cmd_all(states_q, states_p, targets_enc, targets_v_enc)
+    
+    # note: obstacle avoidance term is stolen from saber
+    cmd = saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls) + u_enc
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Static Shapes
+# -------------
+def kernel_statics(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    u_statics = statics.compute_cmd_all(states_q, states_p, targets_enc, targets_v_enc)
+    
+    # note: obstacle avoidance term is stolen from saber
+    cmd = saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls) + u_statics
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Starling
+# --------
+def kernel_starling(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    # note: the interaction ranges (in params) are updated for all agents at once
+    cmd, params = starling_tools.compute_cmd_all(targets, centroid, states_q, states_p, params, 0.02)
+    
+    return cmd, params, no_pins(states_q.shape[1])
+
+# Pinning
+# -------
+def kernel_pinning(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params):
+    
+    # select pins
+    #pin_matrix = pinning_tools.select_pins(states_q) 
+    #pin_matrix = pinning_tools.select_pins_components(states_q, 'gramian') 
+    pin_matrix = pinning_tools.select_pins_components(states_q) 
+    
+    # lattice, obstacle and navigation terms 
+    nbrs = neighbour_list(states_q, pinning_tools.default_params.r)
+    u_int = pinning_tools.compute_cmd_a_pairs(states_q, states_p, nbrs)
+    u_obs = pinning_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls)
+    u_nav = pinning_tools.compute_cmd_g_all(states_q, states_p, targets, targets_v, pin_matrix)
+    cmd = u_int + u_obs + u_nav
+    
+    # if using pinning control
+    # pin (agent 0) just does the u_nav part
+    # --------------------------------------
+    #cmd[:,0] = u_nav[:,0] 
     
     return cmd, params, pin_matrix
 
+# registry of kernels, by tactic type
+kernels = {'reynolds':  kernel_reynolds,
+           'saber':     kernel_saber,
+           'circle':    kernel_circle,
+           'lemni':     kernel_lemni,
+           'statics':   kernel_statics,
+           'starling':  kernel_starling,
+           'pinning':   kernel_pinning}
 
+# find the kernel for a tactic (do this once, when the run starts)
+def resolve(tactic_type):
+    if tactic_type not in kernels:
+        raise Exception('Unknown tactic type: ', tactic_type)
+    return kernels[tactic_type]
 
+#%% Tactic Command Equations 
+# ------------------------  
+# note: kept for callers that pass the tactic type each step (see resolve)
+def commands(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, tactic_type, centroid, params):   
+     
+    cmd, params, pin_matrix = resolve(tactic_type)(states_q, states_p, obstacles, walls, targets, targets_v, targets_enc, targets_v_enc, swarm_prox, centroid, params)
+    
+    # the commands may be borrowed (see kernels), so return a copy
+    return cmd.copy(), params, pin_matrix
 
@@ -42,7 +42,7 @@ import ctrl_tactic as tactic
 # utilities 
 from utils import encirclement_tools as encircle_tools
 from utils import staticShapes_tools as statics
-from utils import pinning_tools, lemni_tools, starling_tools, swarm_metrics, tools, modeller
+from utils import pinning_tools, lemni_tools, starling_tools, swarm_metrics, tools, modeller, collision_tools, trajectory_tools
 #from utils import graph_tools
 
 #%% Setup Simulation
@@ -55,6 +55,7 @@ nVeh    =   15         # number of vehicles
 iSpread =   20         # initial spread of vehicles
 tSpeed  =   0.005         # speed of target
 rVeh    =   0.5         # physical radius of vehicle 
+record_lemni = 1        # store the twists (lemni) of every step? (0 = no, 1 = yes)
 
 tactic_type = 'pinning'     
                 # reynolds = Reynolds flocking + Olfati-Saber obstacle
@@ -92,6 +93,9 @@ pin_matrix = np.zeros((nVeh,nVeh))
 if tactic_type == 'pinning':
     pin_matrix = pinning_tools.select_pins_components(state[0:3,:])
 
+# find the command kernel for this tactic (once, for the whole run)
+tactic_kernel = tactic.resolve(tactic_type)
+
 # Commands
 # --------
 cmd = np.zeros((3,nVeh))
@@ -200,13 +204,14 @@ targets_all         = np.zeros([nSteps, len(targets), nVeh])
 obstacles_all       = np.zeros([nSteps, len(obstacles), nObs])
 centroid_all        = np.zeros([nSteps, len(centroid), 1])
 f_all               = np.ones(nSteps)
-lemni_all           = np.zeros([nSteps, nVeh])
+lemni_all           = np.zeros([nSteps if record_lemni == 1 else 1, nVeh])
 # metrics_order_all   = np.zeros((nSteps,7))
 # metrics_order       = np.zeros((1,7))
 nMetrics            = 12 # there are 11 positions being used.    
 metrics_order_all   = np.zeros((nSteps,nMetrics))
 metrics_order       = np.zeros((1,nMetrics))
 pins_all            = np.zeros([nSteps, nVeh, nVeh])
+collisions          = collision_tools.recorder()    # log of collisions and near misses
 
 # store the initial conditions
 t_all[0]                = Ti
@@ -224,6 +229,14 @@ pins_all[0,:,:]         = pin_matrix
 # we need to move the 'target' for mobbing (a type of lemniscate)
 if tactic_type == 'lemni':
     targets = lemni_tools.check_targets(targets)
+
+# trajectory generator (keeps its own last twist and ordering of agents)
+if tactic_type == 'circle':
+    trajectory_gen = trajectory_tools.generator(encircle_tools.circle_step, nVeh)
+elif tactic_type == 'lemni':
+    trajectory_gen = trajectory_tools.generator(lemni_tools.lemni_step, nVeh)
+elif tactic_type == 'statics':
+    trajectory_gen = trajectory_tools.generator(statics.lemni_step, nVeh)
     
 #%% start the simulation
 # --------------------
@@ -261,6 +274,9 @@ while round(t,3) < Tf:
     # -----------------
     state = node.evolve(Ts, state, cmd)
     #state = node.evolve_sat(Ts, state, cmd)
+    
+    # log any collisions (and near misses)
+    collisions.detect(state[0:3,:], i)
      
     # Store results
     # -------------
@@ -271,7 +287,8 @@ while round(t,3) < Tf:
     obstacles_all[i,:,:]    = obstacles
     centroid_all[i,:,:]     = centroid
     f_all[i]                = f
-    lemni_all[i,:]          = lemni
+    if record_lemni == 1:
+        lemni_all[i,:]      = lemni
     metrics_order_all[i,:]  = metrics_order
     pins_all[i,:,:]         = pin_matrix  
     
@@ -287,17 +304,9 @@ while round(t,3) < Tf:
     if tactic_type == 'reynolds' or tactic_type == 'saber' or tactic_type == 'starling' or tactic_type == 'pinning':
         trajectory = targets 
     
-    # if encircling
-    if tactic_type == 'circle':
-        trajectory, _ = encircle_tools.encircle_target(targets, state)
-    
-    # if lemniscating
-    elif tactic_type == 'lemni':
-        trajectory, lemni = lemni_tools.lemni_target(nVeh,lemni_all,state,targets,i,t)
-    
-    # if static shapes  
-    elif tactic_type == 'statics':
-        trajectory, lemni = statics.lemni_target(nVeh,lemni_all,state,targets,i,t)
+    # if encircling, lemniscating or static shapes
+    if tactic_type == 'circle' or tactic_type == 'lemni' or tactic_type == 'statics':
+        trajectory, lemni = trajectory_gen.step(state, targets, t)
             
     #%% Prep for compute commands (next step)
     # ----------------------------
@@ -334,7 +343,8 @@ while round(t,3) < Tf:
             
     #%% Compute the commads (next step)
     # --------------------------------       
-    cmd, params, pin_matrix = tactic.commands(states_q, states_p, obstacles_plus, walls, targets[0:3,:], targets[3:6,:], trajectory[0:3,:], trajectory[3:6,:], swarm_prox, tactic_type, centroid, params)
+    # note: cmd may be borrowed (see ctrl_tactic), it is used and stored before the next call
+    cmd, params, pin_matrix = tactic_kernel(states_q, states_p, obstacles_plus, walls, targets[0:3,:], targets[3:6,:], trajectory[0:3,:], trajectory[3:6,:], swarm_prox, centroid, params)
        
 #%% Produce animation of simulation
 # ---------------------------------
@@ -379,6 +389,10 @@ ax.grid()
 #fig.savefig("test.png")
 plt.show()
 
+#%% Collisions
+# -------------
+print('collisions: ', collisions.summary())
+
 #%% Save stuff
 
 pickle_out = open("Data/t_all.pickle","wb")
@@ -401,4 +415,7 @@ pickle.dump(centroid_all, pickle_out)
 pickle_out = open("Data/lemni_all.pickle","wb")
 pickle.dump(lemni_all, pickle_out)
 pickle_out.close()
+pickle_out = open("Data/collisions_all.pickle","wb")
+pickle.dump(collisions.events(), pickle_out)
+pickle_out.close()
 
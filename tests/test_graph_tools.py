@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression checks for graph_tools
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import graph_tools as grph
+from utils import neighbour_tools as nbr_tools
+
+# the sparse Laplacian passes its checks and matches the dense one
+def test_lap_matrix_sparse():
+
+    np.random.seed(2)
+    nNodes = 40
+    r = 5
+    data = 20*np.random.rand(3,nNodes)
+
+    i, j = nbr_tools.build_pairs(data, r)
+    A = grph.adj_matrix_sparse(i, j, nNodes)
+    L = grph.lap_matrix_sparse(A, check = True)
+    assert (L.toarray() == grph.deg_matrix(data, r) - grph.adj_matrix(data, r)).all()
+
+    # weighted, as for the lattice
+    w_ij = np.random.rand(len(i))
+    L = grph.lap_matrix_sparse(grph.adj_matrix_sparse(i, j, nNodes, w_ij), check = True)
+    assert np.allclose(np.asarray(L.sum(axis=1)).ravel(), 0)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression checks for param_tools
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import param_tools, saber_tools, pinning_tools
+
+# the bump function takes scalars as well as arrays, and all copies agree
+def test_rho_h_scalars():
+
+    params = param_tools.lattice_params(a = 0.5, b = 0.5, eps = 0.1, h = saber_tools.h, c1_a = 1, c2_a = 2,
+                                        c1_b = 1, c2_b = 2, c1_g = 1, c2_g = 2, d = 5, r = 6,
+                                        d_prime = 3, r_prime = 4, maxAlt = 10)
+
+    for z in [-0.5, 0, 0.5, saber_tools.h, 0.95, 1, 2]:
+        rho = params.rho_h(z)
+        assert np.ndim(rho) == 0
+        assert rho == saber_tools.rho_h(z)
+        assert param_tools.rho_h(z, pinning_tools.h) == pinning_tools.rho_h(z)
+
+    # in place, as in the swarm-level kernels
+    z = np.linspace(-0.5, 2, 101)
+    out = z.copy()
+    param_tools.rho_h(out, saber_tools.h, out = out)
+    assert np.array_equal(out, params.rho_h(z))
+    assert out[0] == 0 and out[-1] == 0 and out[50] == 1
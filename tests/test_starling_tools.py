@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression checks for starling_tools
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import starling_tools
+
+# a swarm at rest (zero velocities) has no forward direction, but the commands stay finite
+def test_swarm_at_rest():
+    
+    np.random.seed(1)
+    nNodes = 10
+    states_q = 20*(np.random.rand(3,nNodes)-0.5)
+    states_p = np.zeros((3,nNodes))
+    targets = np.zeros((3,nNodes))
+    params = np.zeros((4,nNodes))
+    
+    cmd, params = starling_tools.compute_cmd_all(targets, None, states_q, states_p, params, 0.02)
+    assert np.all(np.isfinite(cmd))
+    assert np.all(np.isfinite(params))
+    
+    # and again, from the updated states (the neighbour search must not fail)
+    states_p = states_p + 0.02*cmd
+    states_q = states_q + 0.02*states_p
+    cmd, params = starling_tools.compute_cmd_all(targets, None, states_q, states_p, params, 0.02)
+    assert np.all(np.isfinite(cmd))
+    
+    # same for the reference (per agent) version 
+    params = np.zeros((4,nNodes))
+    for k_node in range(nNodes):
+        cmd_i, params = starling_tools.compute_cmd(targets, None, states_q, np.zeros((3,nNodes)), k_node, params, 0.02)
+        assert np.all(np.isfinite(cmd_i))
+
+# the noise stream starts again after a reset, or when the seed changes
+def test_noise_stream_reset():
+    
+    seed = starling_tools.noise_seed
+    try:
+        starling_tools.reset_noise()
+        first = starling_tools.noise_stream(10).draw().copy()
+        assert not np.array_equal(first, starling_tools.noise_stream(10).draw())
+        starling_tools.reset_noise()
+        assert np.array_equal(first, starling_tools.noise_stream(10).draw())
+        starling_tools.noise_seed = seed + 1
+        assert not np.array_equal(first, starling_tools.noise_stream(10).draw())
+        assert starling_tools.noise_stream(12).draw().shape == (3,12)
+    finally:
+        starling_tools.noise_seed = seed
+        starling_tools.reset_noise()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module records collisions (and near misses) between agents
+
+Each step, all pairs closer than the near miss range are found at once (with
+the neighbour search in neighbour_tools) and logged as compact events:
+    (step, i, j, dist), with i < j
+
+Events go into an array that grows as required (no printing in the loop), and
+the counts and a summary are available at the end of the run.
+
+Usage:
+
+    collisions = recorder()                 # ranges default to the hyperparameters below
+    collisions.detect(states_q, step)       # each step
+    collisions.events()                     # all events (structured array)
+    collisions.summary()                    # counts, closest approach, agents involved
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import neighbour_tools as nbr_tools
+
+#%% Hyperparameters
+# -----------------
+collision_range = 0.1   # closer than this is a collision (same as the Reynolds rules)
+near_miss_range = 1     # closer than this is a near miss (nominally, twice the vehicle radius)
+
+# format of one event
+event_dtype = np.dtype([('step', np.int64), ('i', np.int64), ('j', np.int64), ('dist', np.float64)])
+
+#%% Event recorder
+# ----------------
+
+class recorder:
+
+    # initializes an (empty) log
+    def __init__(self, collision_range = None, near_miss_range = None, capacity = 1024):
+
+        # defaults to the module settings (as set at the time)
+        if collision_range is None:
+            collision_range = globals()['collision_range']
+        if near_miss_range is None:
+            near_miss_range = globals()['near_miss_range']
+        self.collision_range    = collision_range
+        self.near_miss_range    = max(near_miss_range, collision_range)    # collisions are also near misses
+        self.log                = np.zeros(capacity, dtype = event_dtype)
+        self.nEvents            = 0     # number of events logged
+        self.nCollisions        = 0     # number of collisions (pairs, summed over steps)
+        self.nNearMisses        = 0     # number of near misses (excluding collisions)
+        self.nSteps             = 0     # number of steps checked
+
+    # add events to the log (growing it, if required)
+    def record(self, step, i, j, dist):
+
+        nNew = len(i)
+        if self.nEvents + nNew > len(self.log):
+            log = np.zeros(max(2*len(self.log), self.nEvents + nNew), dtype = event_dtype)
+            log[0:self.nEvents] = self.log[0:self.nEvents]
+            self.log = log
+        new = self.log[self.nEvents:self.nEvents+nNew]
+        new['step'] = step
+        new['i']    = i
+        new['j']    = j
+        new['dist'] = dist
+        self.nEvents += nNew
+
+    # find (and log) all pairs closer than the near miss range, returns the number of collisions
+    def detect(self, states_q, step):
+
+        self.nSteps += 1
+        i, j = nbr_tools.build_pairs(states_q, self.near_miss_range)
+        dist = np.sqrt(np.sum((states_q[:,j]-states_q[:,i])**2, axis=0))
+        self.record(step, i, j, dist)
+        nCollisions = np.count_nonzero(dist < self.collision_range)
+        self.nCollisions += nCollisions
+        self.nNearMisses += len(dist) - nCollisions
+        return nCollisions
+
+    # all events logged so far
+    def events(self):
+        return self.log[0:self.nEvents]
+
+    # only the collisions
+    def collisions(self):
+        events = self.events()
+        return events[events['dist'] < self.collision_range]
+
+    # summary of the run
+    def summary(self):
+
+        events      = self.events()
+        collisions  = self.collisions()
+        return {'nSteps':           self.nSteps,
+                'nCollisions':      self.nCollisions,
+                'nNearMisses':      self.nNearMisses,
+                'steps_colliding':  len(np.unique(collisions['step'])),
+                'agents_colliding': np.unique(np.concatenate((collisions['i'], collisions['j']))).tolist(),
+                'min_dist':         np.min(events['dist']) if self.nEvents > 0 else np.inf}
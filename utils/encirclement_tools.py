@@ -32,6 +32,11 @@ quat_0 = quat.e2q(np.array([0,0,0]))    # if lemniscate, this has to be all zero
 quatern = quat_0                        # uncessary duplicate (legacy code)
 quat_0_ = quat.quatjugate(quat_0)       # used to untwist   
 
+# ordering of agents by angle 
+ordering = 'incremental'    # sort = full sort every step
+                            # incremental = repair the order from the previous step (full sort if that fails)
+repair_passes = 4           # max number of (odd-even) swap passes when repairing the order
+
 #%% Useful functions
 # -------------------
 
@@ -83,6 +88,53 @@ def centroid(points):
     return centroid.transpose() 
 
 
+#%% Angular ordering
+# ------------------
+# note: agents on the circle rarely change order between steps, so the order
+# from the last step is usually still sorted, apart from a shift when agents 
+# wrap around (through 2pi to 0) or a few swapped neighbours. Repairing it 
+# costs O(N); we only fall back to a full sort when that fails.
+
+class angular_order:
+    
+    def __init__(self):
+        
+        self.order  = None  # indices of the agents, sorted by angle (last step)
+        self.nSorts = 0     # number of full sorts
+        
+    # indices that sort the angles
+    def update(self, phi):
+        
+        if ordering == 'incremental' and self.order is not None and len(self.order) == len(phi):
+            order = self.repair(phi, self.order)
+            if order is not None:
+                self.order = order
+                return order
+        self.nSorts += 1
+        self.order = np.argsort(phi, axis=0)
+        return self.order
+    
+    # repairs a nearly sorted order (None if that fails)
+    def repair(self, phi, order):
+        
+        # detect wrap around (the smallest angle should come first)
+        order = np.roll(order, -np.argmin(phi[order]))
+        # swap neighbours that are out of order (alternating even and odd pairs)
+        for _ in range(repair_passes):
+            phi_order = phi[order]
+            if np.all(phi_order[0:-1] <= phi_order[1:]):
+                return order
+            for start in (0,1):
+                i = np.arange(start, len(order)-1, 2)
+                swap = i[phi[order[i]] > phi[order[i+1]]]
+                order[swap], order[swap+1] = order[swap+1], order[swap]
+        phi_order = phi[order]
+        if np.all(phi_order[0:-1] <= phi_order[1:]):
+            return order
+        return None
+
+angles = angular_order()
+
 #%% Encirclement calculations
 # ---------------------------
 
@@ -92,8 +144,23 @@ def compute_cmd(states_q, states_p, targets_enc, targets_v_enc, k_node):
     u_enc[:,k_node] = - c1_d*sigma_1(states_q[:,k_node]-targets_enc[:,k_node])-c2_d*(states_p[:,k_node] - targets_v_enc[:,k_node])    
     
     return u_enc[:,k_node]
+
+# all agents at once (3 x N)
+def compute_cmd_all(states_q, states_p, targets_enc, targets_v_enc):
+    
+    u_enc = - c1_d*sigma_1(states_q-targets_enc)-c2_d*(states_p - targets_v_enc)
+    
+    return u_enc
+    
+# trajectory for one step (as used by trajectory_tools.generator, no twist)
+def circle_step(state, targets, last_twist, i, t, order = None):
     
-def encircle_target(targets, state):
+    targets_encircle, _ = encircle_target(targets, state, order)
+    
+    return targets_encircle, np.zeros([1, state.shape[1]])
+
+# note: order is the angular_order to update (defaults to the one for this module)
+def encircle_target(targets, state, order = None):
         
     # desired rate of encirclement [rad/s]
     # -----------------------------------
@@ -102,98 +169,60 @@ def encircle_target(targets, state):
     # initialise global stuff
     # -----------------------
     targets_encircle = targets.copy() 
-    points_i = np.zeros((3,state.shape[1]))
-    temp = np.zeros((3,1))
     quatern_ = quat.quatjugate(quatern)
+    nNodes = state.shape[1]
     
     # Regulation of Radius (position control)
     # ------------------------------   
-    new_pos_desired_i = np.zeros((3,state.shape[1]))
-    
-    # iterate through each agent
-    for ii in range(0,state.shape[1]):
-   
-        # to rotate with reference to horizontal
-        if enc_plane == 'horizontal':
-            # rotate down to the reference plane
-            points_i[:,ii] = quat.rotate(quatern_,state[0:3,ii]-targets[0:3,ii])+targets[0:3,ii]
-            # now find the desired position projected on the plane
-            temp[0:2,0] = directToCircle(targets[0:2,ii],points_i[0:2,ii],r_desired)
-            temp[2,0] = targets[2,ii] # at altitude
-            # now rotate back
-            new_pos_desired_i[:,ii] = quat.rotate(quatern,temp.ravel()-targets[0:3,ii])+targets[0:3,ii]            
+    # rotate down to the reference plane (all agents at once)
+    points_i = quat.rotate_many(quatern_, state[0:3,:]-targets[0:3,:]) + targets[0:3,:]
+    # now find the desired position projected on the plane (directToCircle, for all agents)
+    temp = np.zeros((3,nNodes))
+    temp[0:2,:] = targets[0:2,:]+r_desired*np.divide(points_i[0:2,:]-targets[0:2,:],np.linalg.norm(points_i[0:2,:]-targets[0:2,:], axis=0))
+    temp[2,:] = targets[2,:] # at altitude
+    # now rotate back
+    new_pos_desired_i = quat.rotate_many(quatern, temp-targets[0:3,:]) + targets[0:3,:]
         
     # Regulation of Angular speed (velocity control)
     # ----------------------------------------------   
     # express state with reference to target
     state_shifted = state - targets
-        
-    # to rotate with reference to horizontal
-    if enc_plane == 'horizontal':
-        # define a new unit vector, which is perp to plane 
-        unit_v = np.array([0,0,1]).reshape((3,1))
-        # initialize a new state vector
-        state_shifted_new = np.zeros((3,state.shape[1]))
-        # rotate each agent into the reference plane
-        for ij in range(0,state.shape[1]):
-            state_shifted_new[:,ij] = quat.rotate(quatern_,state_shifted[0:3,ij])
- 
-        # convert to polar coordinates
-        polar_r, polar_phi = cart2polar(state_shifted_new[0,:], state_shifted_new[1,:])
+    
+    # define a new unit vector, which is perp to plane 
+    unit_v = np.array([0,0,1]).reshape((3,1))
+    # rotate each agent into the reference plane
+    state_shifted_new = quat.rotate_many(quatern_, state_shifted[0:3,:])
+    # convert to polar coordinates
+    polar_r, polar_phi = cart2polar(state_shifted_new[0,:], state_shifted_new[1,:])
   
     # sort by phi and save the indicies so we can reassemble
-    polar_phi_sorted = np.sort(polar_phi, axis=0)
-    polar_phi_argsort = np.argsort(polar_phi, axis=0) 
-    
-    # for each vehicle, define a desired angular speed 
-    phi_dot_desired_i = np.zeros((1,state_shifted.shape[1]))
-    phiDot_out = np.zeros((1,state_shifted.shape[1]))
-     
-    # identify leading and lagging 
-    for ii in range(0,state_shifted.shape[1]):
-        # define leading and lagging vehicles (based on angles)
-        if ii == 0:
-            ij = state_shifted.shape[1]-1    
-        else:
-            ij = ii-1 # lagging vehicle
-        
-        if ii == state_shifted.shape[1]-1:
-            ik = 0
-        else:
-            ik = ii+1 # leading vehicle 
-        
-        # compute distances
-        dist_lag = np.linalg.norm(state_shifted[0:3,ii]-state_shifted[0:3,ij])
-        dist_lead = np.linalg.norm(state_shifted[0:3,ii]-state_shifted[0:3,ik])
-        
-        # if neighbours too far away, default to the desired encirclement speed
-        if dist_lead > r_max or dist_lag > r_max:
-            phi_dot_desired_i[0,ii] = phi_dot_desired
-            continue
-        
-        # compute the desired phi-dot       
-        phi_dot_desired_i[0,ii] = phi_dot_i_desired(polar_phi_sorted[ii], polar_phi_sorted[ij], polar_phi_sorted[ik], phi_dot_desired)
+    if order is None:
+        order = angles
+    polar_phi_argsort = order.update(polar_phi)
+    polar_phi_sorted = polar_phi[polar_phi_argsort]
+    
+    # identify leading and lagging (the previous and next, wrapping around)
+    # note: the distances are between agents with these indices (not sorted by phi)
+    dist_lag = np.linalg.norm(state_shifted[0:3,:]-np.roll(state_shifted[0:3,:], 1, axis=1), axis=0)
+    dist_lead = np.linalg.norm(state_shifted[0:3,:]-np.roll(state_shifted[0:3,:], -1, axis=1), axis=0)
+    
+    # compute the desired phi-dot       
+    phi_dot_desired_i = phi_dot_i_desired(polar_phi_sorted, np.roll(polar_phi_sorted, 1), np.roll(polar_phi_sorted, -1), phi_dot_desired)
+    
+    # if neighbours too far away, default to the desired encirclement speed
+    phi_dot_desired_i[(dist_lead > r_max) | (dist_lag > r_max)] = phi_dot_desired
     
     # convert the angular speeds back to cartesian (in the correct order)
     # ----------------------------------------------
-    xy_dot_desired_i = np.zeros((3,state.shape[1]))
+    # get angular speeds
+    w_vectors = quat.rotate_many(quatern, phi_dot_desired_i*unit_v)
+    # find the corresponding velo vectors
+    xy_dot_desired_i = np.zeros((3,nNodes))
+    xy_dot_desired_i[:,polar_phi_argsort] = np.cross(w_vectors, state_shifted[0:3,polar_phi_argsort], axis=0)
     
-    index_proper = 0
-    for ii in polar_phi_argsort:
-        
-        # get angular speed 
-        w_vector = quat.rotate(quatern,phi_dot_desired_i[0,index_proper]*unit_v)
-        # find the corresponding velo vector
-        v_vector = np.cross(w_vector.ravel(),state_shifted[0:3,ii])
-        # break out into components
-        xy_dot_desired_i[0,ii] = v_vector[0] 
-        xy_dot_desired_i[1,ii] = v_vector[1] 
-        xy_dot_desired_i[2,ii] = v_vector[2] 
-        
-        #fix phiDot
-        phiDot_out[0,ii] = phi_dot_desired_i[0,index_proper]
-        
-        index_proper += 1
+    #fix phiDot
+    phiDot_out = np.zeros((1,nNodes))
+    phiDot_out[0,polar_phi_argsort] = phi_dot_desired_i
  
     # define new targets for encirclement
     # ----------------------------------
@@ -203,7 +232,3 @@ def encircle_target(targets, state):
         targets_encircle[3:6,:] = -xy_dot_desired_i[:,:] 
 
     return targets_encircle, phiDot_out
-
-
-
-
@@ -21,8 +21,11 @@ Preliminaries:
 # ------------
 import numpy as np
 import random
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
 import heapq 
+from scipy import sparse
+from scipy.sparse import csgraph
+from utils import neighbour_tools as nbr_tools
 
 # Parameters
 # ----------
@@ -35,21 +38,14 @@ import heapq
 def build_graph(data, r):
     G = {}
     nNodes  = data.shape[1]     # number of agents (nodes)
-    # for each node
+    # each node is in its own set of edges
     for i in range(0,nNodes):
-        # create a set of edges
-        set_i = set()
-        # search through neighbours (will add itself)
-        for j in range(0,nNodes):
-            # compute distance
-            dist = np.linalg.norm(data[0:3,j]-data[0:3,i])
-            # if close enough
-            if dist < r:
-                # add to set_i
-                set_i.add(j)
-            #else:
-            #    print("debug: ", i," is ", dist, "from ", j)
-        G[i] = set_i
+        G[i] = {i}
+    # add the neighbours (found with the spatial index)
+    i_pairs, j_pairs = nbr_tools.build_pairs(data[0:3,:], r)
+    for i, j in zip(i_pairs.tolist(), j_pairs.tolist()):
+        G[i].add(j)
+        G[j].add(i)
     return G
 
 # count all
@@ -128,22 +124,18 @@ def search_djikstra(G, source):
 # ------------------------------
 
 # A = {a_ij} s.t. 1 if i,j are neighbours, 0 if not
-def adj_matrix(data,r):
+# note: as_sparse = True returns a scipy.sparse (csr) matrix
+def adj_matrix(data,r,as_sparse=False):
     # initialize
     nNodes  = data.shape[1]             # number of agents (nodes)
+    # find neighbours (found with the spatial index, skips self)
+    i, j = nbr_tools.build_pairs(data[0:3,:], r)
+    if as_sparse:
+        return adj_matrix_sparse(i, j, nNodes)
     A       = np.zeros((nNodes,nNodes)) # initialize adjacency matrix as zeros
-    # for each node
-    for i in range(0,nNodes):  
-        # search through neighbours
-        for j in range(0,nNodes):
-            # skip self
-            if i != j:
-                # compute distance
-                dist = np.linalg.norm(data[0:3,j]-data[0:3,i])
-                # if close enough
-                if dist < r:
-                    # mark as neighbour
-                    A[i,j] = 1
+    # mark as neighbours
+    A[i,j] = 1
+    A[j,i] = 1
     # ensure A = A^T
     assert (A == A.transpose()).all()
     # return the matrix
@@ -153,24 +145,16 @@ def adj_matrix(data,r):
 #%% Compute the Degree Matrix
 # ------------------------------
 # D = diag{d1,d2,...dN}
-def deg_matrix(data,r):
-    # initialize
-    nNodes  = data.shape[1]             # number of agents (nodes)
-    D       = np.zeros((nNodes,nNodes)) # initialize degree matrix as zeros
-    # for each node
-    for i in range(0,nNodes):
-        # search through neighbours
-        for j in range(0,nNodes):
-            # skip self
-            if i != j:
-                # compute distance
-                dist = np.linalg.norm(data[0:3,j]-data[0:3,i])
-                # if close enough
-                if dist < r:
-                    # mark as neighbour
-                    D[i,i] += 1
-    # return the matrix
-    return D
+def deg_matrix(data,r,as_sparse=False):
+    # count the neighbours of each node (from the adjacency)
+    return deg_matrix_A(adj_matrix(data,r,as_sparse))
+
+# D = diag{d1,d2,...dN}, from the row sums of an adjacency matrix we already have (dense or sparse)
+# note: for a component, slice A (e.g. A[np.ix_(nodes,nodes)]) rather than searching again 
+def deg_matrix_A(A):
+    if sparse.issparse(A):
+        return deg_matrix_sparse(A)
+    return np.diag(A.sum(axis=1))
 
 #%% Compute the graph Laplacian
 # -----------------------------
@@ -186,6 +170,53 @@ def lap_matrix(A,D):
     # return the matrix
     return L
 
+#%% Sparse (weighted) matrices
+# ----------------------------
+# note: built from a list of pairs (i < j), as from neighbour_tools, with 
+# weights w_ij (1 by default, or a_ij for the lattice in saber/pinning)
+
+# A = {w_ij} s.t. w_ij if i,j are neighbours, 0 if not 
+def adj_matrix_sparse(i, j, nNodes, w_ij = None):
+    if w_ij is None:
+        w_ij = np.ones(len(i))
+    # store both (i,j) and (j,i), so A = A^T
+    rows = np.concatenate((i, j))
+    cols = np.concatenate((j, i))
+    A = sparse.csr_matrix((np.concatenate((w_ij, w_ij)), (rows, cols)), shape=(nNodes,nNodes))
+    return A
+
+# D = diag{d1,d2,...dN}, from the row sums of A
+def deg_matrix_sparse(A):
+    D = sparse.diags(np.asarray(A.sum(axis=1)).ravel(), format='csr')
+    return D
+
+# L = D - A
+# note: the checks each pass over the whole matrix, so they are off by default (this is 
+# built every step in the laplacian alignment); turn them on with check = True when debugging
+def lap_matrix_sparse(A, check = False):
+    L = deg_matrix_sparse(A) - A
+    if check:
+        # ensure L = L^T
+        assert abs(L - L.transpose()).max() == 0
+        # ensure has zero row sum (to round-off)
+        assert np.allclose(np.asarray(L.sum(axis=1)).ravel(), 0)
+        # ensure Positive Semi-Definite (true for a Laplacian with non-negative weights)
+        assert A.min() >= 0
+    return L
+
+# components (and the component of each node), from the sparse adjacency
+# note: same count as the zero eigen values of L (see compute_comp), without the eigen values
+def compute_comp_sparse(A):
+    nComp, labels = csgraph.connected_components(A, directed=False)
+    return nComp, labels
+
+# the nodes of each component (ascending), as a list of lists 
+def find_connected_components_sparse(A):
+    nComp, labels = compute_comp_sparse(A)
+    order = np.argsort(labels, kind='stable')
+    splits = np.cumsum(np.bincount(labels, minlength=nComp))[0:-1]
+    return [component.tolist() for component in np.split(order, splits)]
+
 #%% Compute components
 # --------------------
 def compute_comp(L):
@@ -271,73 +302,76 @@ def compute_gram_trace(A,D,node,horizon):
 
 #%% compute Betweenness Centrality
 # ------------------------------
+# note: Brandes' algorithm (BFS from each node, as each hop costs 1), which 
+# counts all the shortest paths between each pair, in O(VE). For each node v,
+#   B(v) = sum over s,t (s != v != t) of sigma_st(v)/sigma_st
+# where sigma_st is the number of shortest paths from s to t, and sigma_st(v)
+# the number of those through v. The sum is over ordered pairs (both s->t and 
+# t->s), normalized by n(n+1)/2 as before.
+
+# from a graph (as dictionary)
 def betweenness(G):
     
-    # store the betweenness for each node
-    all_paths = {}
-    k = 0
+    # pack the neighbours (skip self) into arrays (CSR)
+    nNodes  = len(G)
+    nbrs    = [sorted(G[i] - {i}) for i in range(0,nNodes)]
+    indptr  = np.concatenate(([0], np.cumsum([len(nbrs_i) for nbrs_i in nbrs]))).astype(int)
+    indices = np.array([j for nbrs_i in nbrs for j in nbrs_i], dtype=int)
+    B = betweenness_csr(indptr, indices)
     
-    # create a nested dict of all the shortest paths 
-    for i in range(0,len(G)):
-        
-        parents, _      = search_djikstra(G,i)
-        all_paths[k]    = parents
-        k += 1
+    return {n: B[n] for n in range(0,nNodes)}
+
+# from an adjacency matrix (dense or sparse), returns an array
+def betweenness_A(A):
     
-    # count all the influencers (i.e. those on shortest paths)
-    influencers = count_influencers(G,all_paths)
-    # sum of all paths
-    summ = len(G)*(1+len(G))/2
+    A = sparse.csr_matrix(A)
     
-    return {n: influencers[n] / summ for n in influencers}
-
+    return betweenness_csr(A.indptr, A.indices)
 
-#%% count instances of node appearing in a shortest path
-# ------------------------------------------------------
-def count_influencers(G,all_paths):
-
-    influencers = defaultdict(lambda: float(0))
+# from the neighbours of each node i, indices[indptr[i]:indptr[i+1]]
+def betweenness_csr(indptr, indices):
     
-    # do all this for each destination nodes
-    for k in range(0,len(G)):
-        
-        # create a set of all other nodes
-        search = set(range(0,len(G)))
-        search.remove(k)
+    nNodes  = len(indptr)-1
+    nbrs    = [indices[indptr[i]:indptr[i+1]].tolist() for i in range(0,nNodes)]
+    B       = np.zeros(nNodes)
     
-        # we will search through all the other nodes
-        while search:
+    # for each source
+    for s in range(0,nNodes):
         
-            # select and remove a node
-            i = search.pop()
-            
-            # this will be part of the search
-            sub_search = set()
-            sub_search.add(i)
-            
-            # but so will others we find along the way (sub search)
-            while sub_search:
-                
-                j = sub_search.pop()
-            
-                # identify the parent 
-                parent_i = all_paths[k][j]
-                
-                # if this this the destination
-                if parent_i == k:
-                    # get out
-                    continue
-                # else, keep looking
-                else:
-                
-                    # add this to the subsearch
-                    sub_search.add(parent_i)
-            
-                    # count this parent as part of a path
-                    influencers[parent_i] += 1
-                    #print(parent_i, 'is a parent of', j, 'of ...', k )
+        # BFS, counting the shortest paths (sigma) and the parents on them
+        visited = []                        # nodes, in order of distance from source
+        parents = [[] for _ in range(0,nNodes)]
+        sigma   = [0]*nNodes
+        sigma[s] = 1
+        dist    = [-1]*nNodes
+        dist[s] = 0
+        queue   = deque([s])
+        while queue:
+            i = queue.popleft()
+            visited.append(i)
+            for j in nbrs[i]:
+                # found for the first time
+                if dist[j] < 0:
+                    dist[j] = dist[i] + 1
+                    queue.append(j)
+                # on a shortest path
+                if dist[j] == dist[i] + 1:
+                    sigma[j] += sigma[i]
+                    parents[j].append(i)
         
-    return influencers 
+        # accumulate the dependencies (farthest nodes first)
+        delta = [0.0]*nNodes
+        while visited:
+            j = visited.pop()
+            for i in parents[j]:
+                delta[i] += sigma[i]/sigma[j]*(1 + delta[j])
+            if j != s:
+                B[j] += delta[j]
+    
+    # sum of all paths
+    summ = nNodes*(1+nNodes)/2
+    
+    return B/summ
 
 
 # find connected components
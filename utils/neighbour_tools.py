@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module builds neighbour lists for the interaction kernels
+
+Each symmetric pair (i,j) is stored once (i < j) in compressed sparse row (CSR) form:
+    - indices[indptr[i]:indptr[i+1]] are the neighbours j > i of agent i
+    - the kernels evaluate each pair once, then scatter the result back to
+    both agents (+ for i, - for j, when the term is antisymmetric)
+
+@author: tjards
+"""
+
+import numpy as np
+from scipy.spatial.distance import pdist
+from utils import spatial_tools
+
+#%% Hyperparameters
+# -----------------
+search = 'grid'     # how to find neighbours 
+                        # brute = all pairwise distances 
+                        # grid = uniform grid cell list (see spatial_tools)
+
+#%% Build neighbour lists
+# -----------------------
+
+# pairs (i < j) within range r
+def build_pairs(states_q, r):
+    if search == 'grid':
+        index = spatial_tools.grid(r)
+        index.build(states_q)
+        return index.pairs_within(r)
+    else:
+        return build_pairs_brute(states_q, r)
+
+# pairs (i < j) within range r, from all pairwise distances
+def build_pairs_brute(states_q, r):
+    nNodes = states_q.shape[1]
+    # condensed distances follow the order of the upper triangle
+    dist = pdist(states_q.transpose())
+    i, j = np.triu_indices(nNodes, k=1)
+    in_range = dist < r
+    return i[in_range], j[in_range]
+
+# compress pairs (sorted by i) into CSR form
+def to_csr(i, j, nNodes):
+    indptr = np.zeros(nNodes+1, dtype=int)
+    np.cumsum(np.bincount(i, minlength=nNodes), out=indptr[1:])
+    return indptr, j
+
+# expand CSR form back into pairs
+def to_pairs(nbrs):
+    indptr, indices = nbrs
+    i = np.repeat(np.arange(indptr.shape[0]-1), np.diff(indptr))
+    return i, indices
+
+# neighbour list (CSR) at cutoff r, built once per step
+def neighbour_list(states_q, r):
+    i, j = build_pairs(states_q, r)
+    return to_csr(i, j, states_q.shape[1])
+
+#%% Scatter pair results back to agents
+# -------------------------------------
+
+# antisymmetric terms, f_ji = -f_ij (returns dims x N)
+def scatter_antisym(f_ij, i, j, nNodes):
+    u = np.zeros((f_ij.shape[0], nNodes))
+    for dim in range(f_ij.shape[0]):
+        u[dim,:] = np.bincount(i, f_ij[dim,:], nNodes) - np.bincount(j, f_ij[dim,:], nNodes)
+    return u
+
+# symmetric terms, f_ji = f_ij (returns dims x N)
+def scatter_sym(f_ij, i, j, nNodes):
+    u = np.zeros((f_ij.shape[0], nNodes))
+    for dim in range(f_ij.shape[0]):
+        u[dim,:] = np.bincount(i, f_ij[dim,:], nNodes) + np.bincount(j, f_ij[dim,:], nNodes)
+    return u
+
+#%% Verlet lists
+# --------------
+
+# Candidates are found once at range r + skin, then filtered to r every step.
+# The candidates are only rebuilt when some agent has moved more than skin/2 
+# since the last build (then no pair can have come from outside r + skin),  
+# so the neighbours are identical to an exact search at r.
+
+class verlet:
+
+    # initializes an (empty) Verlet list
+    def __init__(self, r, skin):
+
+        self.r          = r         # cutoff
+        self.skin       = skin      # extra range for the candidates
+        self.q_built    = None      # positions at the last build
+        self.nBuilds    = 0         # number of (re)builds (for diagnostics)
+        self.nUpdates   = 0         # number of updates 
+
+    # has any agent moved more than skin/2 since the last build?
+    def check_rebuild(self, states_q):
+        if self.q_built is None or self.q_built.shape != states_q.shape:
+            return True
+        disp_sqr = np.sum((states_q-self.q_built)**2, axis=0)
+        return np.max(disp_sqr, initial=0) > (self.skin/2)**2
+
+    # neighbour list (CSR) at cutoff r, for the current positions
+    def update(self, states_q):
+
+        self.nUpdates += 1
+
+        # rebuild the candidates, if required
+        if self.check_rebuild(states_q):
+            self.i_cand, self.j_cand = build_pairs(states_q, self.r+self.skin)
+            self.q_built = states_q.copy()
+            self.nBuilds += 1
+
+        # keep the candidates actually in range
+        dist_sqr = np.sum((states_q[:,self.j_cand]-states_q[:,self.i_cand])**2, axis=0)
+        in_range = np.sqrt(dist_sqr) < self.r
+
+        return to_csr(self.i_cand[in_range], self.j_cand[in_range], states_q.shape[1])
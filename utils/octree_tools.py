@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module implements an octree for Barnes-Hut style far-field sums
+
+The agents are sorted along a Morton (z-order) curve, so that every cell of the
+tree is a contiguous range of agents, and each cell stores its count, centre of
+mass, summed positions/velocities and bounding box. Sums over all agents within
+some range of each agent are then found by descending the tree (for all agents
+at once, level by level):
+
+    - cells entirely out of range are skipped
+    - cells entirely in range that are small compared to their distance 
+    (size < theta*distance) are taken as a whole: exactly for the linear sums 
+    (count, positions, velocities), through the centre of mass for the nonlinear 
+    sums (unit vectors, inverse square vectors)
+    - small cells (leaf_size agents or fewer) are summed exactly, agent by agent
+    - the rest are opened (their children are searched at the next level)
+
+Cells on the edge of the range are always opened, so the linear sums are exact
+(to round-off) and only the nonlinear sums are approximated. Smaller theta is 
+more accurate for those (theta = 0 is exact); the default, 0.5, is common for 
+Barnes-Hut. For N agents, this takes about O(N log N).
+
+Usage:
+
+    tree = octree(states_q, states_p)
+    sums = tree.sums(states_q, radius, exclude = 0.1)   # radius is per agent (N,)
+    sums['count'], sums['sum_q'], sums['sum_p'], sums['sum_unit'], sums['sum_inv_sqr']
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import spatial_tools
+
+#%% Hyperparameters
+# -----------------
+theta       = 0.5   # opening angle (accuracy), size/distance below which a cell is taken as a whole
+leaf_size   = 8     # cells with this many agents (or fewer) are summed exactly
+max_depth   = 10    # max number of levels below the root (cells are at least 1/2^max_depth of the swarm)
+
+#%% Useful functions
+# ------------------
+
+# interleave the bits of integer cell coordinates (3 x N) into Morton keys
+def morton(cells, depth):
+    keys = np.zeros(cells.shape[1], dtype=np.int64)
+    for bit in range(depth):
+        for dim in range(3):
+            keys |= ((cells[dim,:] >> bit) & 1) << (3*bit + 2 - dim)
+    return keys
+
+# sum values (dims x M) into bins (returns dims x nBins)
+def bin_sum(bins, values, nBins):
+    return np.array([np.bincount(bins, values[dim,:], nBins) for dim in range(values.shape[0])]).reshape(values.shape[0], nBins)
+
+#%% Octree
+# --------
+
+class octree:
+
+    # builds the tree from positions (3 x N) and, optionally, velocities (3 x N)
+    def __init__(self, points, velos = None, depth = max_depth):
+
+        self.nNodes = points.shape[1]
+        self.depth  = depth
+        if velos is None:
+            velos = np.zeros(points.shape)
+
+        # integer cell coordinates at the finest level, then sort along the Morton curve
+        lo      = np.min(points, axis=1, keepdims=True) if self.nNodes > 0 else np.zeros((3,1))
+        extent  = np.max(points - lo) if self.nNodes > 0 else 0
+        scale   = (2**depth)/extent if extent > 0 else 0
+        cells   = np.minimum(np.floor((points - lo)*scale).astype(np.int64), 2**depth - 1)
+        keys    = morton(cells, depth)
+        self.order  = np.argsort(keys, kind='stable')
+        keys        = keys[self.order]
+        self.points = points[:,self.order]
+        self.velos  = velos[:,self.order]
+
+        # the cells at each level (contiguous ranges of the sorted agents)
+        self.levels = []
+        for level in range(depth+1):
+            prefix = keys >> (3*(depth-level))
+            cell_keys, starts, counts = np.unique(prefix, return_index=True, return_counts=True)
+            cell = {'keys': cell_keys, 'starts': starts, 'counts': counts}
+            if self.nNodes > 0:
+                cell['sum_q'] = np.add.reduceat(self.points, starts, axis=1)
+                cell['sum_p'] = np.add.reduceat(self.velos, starts, axis=1)
+                cell['lo']    = np.minimum.reduceat(self.points, starts, axis=1)
+                cell['hi']    = np.maximum.reduceat(self.points, starts, axis=1)
+            else:
+                cell['sum_q'] = cell['sum_p'] = cell['lo'] = cell['hi'] = np.zeros((3,0))
+            cell['com']  = np.divide(cell['sum_q'], np.maximum(counts,1))
+            cell['size'] = np.max(cell['hi'] - cell['lo'], axis=0, initial=0)
+            self.levels.append(cell)
+
+        # the children of each cell (a contiguous range of cells at the next level)
+        for level in range(depth):
+            parents = self.levels[level+1]['keys'] >> 3
+            cell = self.levels[level]
+            cell['child_starts'] = np.searchsorted(parents, cell['keys'], side='left')
+            cell['child_counts'] = np.searchsorted(parents, cell['keys'], side='right') - cell['child_starts']
+
+    # sums over all agents j with exclude <= |q_j - q_i| < radius_i, for each query i
+    #   - queries are positions (3 x M), radius is per query (M,)
+    #   - if the queries are the agents themselves (default), each agent skips itself
+    def sums(self, queries, radius, exclude = 0, theta = None, leaf_size = None, self_index = None):
+
+        # defaults to the hyperparameters (as set at the time)
+        if theta is None:
+            theta = globals()['theta']
+        if leaf_size is None:
+            leaf_size = globals()['leaf_size']
+        nQueries = queries.shape[1]
+        radius = np.broadcast_to(radius, (nQueries,))
+        if self_index is None:
+            self_index = np.arange(nQueries) if nQueries == self.nNodes else -np.ones(nQueries, dtype=int)
+        self_sorted = -np.ones(nQueries, dtype=int)
+        inverse = np.argsort(self.order)
+        has_self = self_index >= 0
+        self_sorted[has_self] = inverse[self_index[has_self]]
+
+        count       = np.zeros(nQueries)
+        sum_q       = np.zeros((3,nQueries))
+        sum_p       = np.zeros((3,nQueries))
+        sum_unit    = np.zeros((3,nQueries))
+        sum_inv_sqr = np.zeros((3,nQueries))
+
+        if self.nNodes == 0 or nQueries == 0:
+            return {'count': count, 'sum_q': sum_q, 'sum_p': sum_p, 'sum_unit': sum_unit, 'sum_inv_sqr': sum_inv_sqr}
+
+        # start with every query against the root
+        frontier_q    = np.arange(nQueries)
+        frontier_cell = np.zeros(nQueries, dtype=int)
+
+        for level in range(self.depth+1):
+
+            if len(frontier_q) == 0:
+                break
+            cell = self.levels[level]
+            q = queries[:,frontier_q]
+            r = radius[frontier_q]
+
+            # distances to the bounding box (nearest and farthest points) and to the centre of mass
+            lo = cell['lo'][:,frontier_cell]
+            hi = cell['hi'][:,frontier_cell]
+            d_min = np.linalg.norm(np.maximum(np.maximum(lo - q, q - hi), 0), axis=0)
+            d_max = np.linalg.norm(np.maximum(np.abs(q - lo), np.abs(q - hi)), axis=0)
+            d_com = cell['com'][:,frontier_cell] - q
+            dist_com = np.linalg.norm(d_com, axis=0)
+
+            # skip the cells out of range
+            in_range = d_min < r
+
+            # take the small, far away cells entirely in range as a whole (if all their agents are beyond exclude)
+            whole = in_range & (d_max < r) & (cell['size'][frontier_cell] < theta*dist_com) & (d_min > exclude)
+            i_take = frontier_q[whole]
+            c_take = frontier_cell[whole]
+            n_take = cell['counts'][c_take]
+            count += np.bincount(i_take, n_take, nQueries)
+            sum_q += bin_sum(i_take, cell['sum_q'][:,c_take], nQueries)
+            sum_p += bin_sum(i_take, cell['sum_p'][:,c_take], nQueries)
+            sum_unit += bin_sum(i_take, n_take*np.divide(d_com[:,whole], dist_com[whole]), nQueries)
+            sum_inv_sqr += bin_sum(i_take, n_take*np.divide(d_com[:,whole], dist_com[whole]**2), nQueries)
+
+            # sum the small cells (and the last level) exactly
+            rest = in_range & ~whole
+            leaf = rest & ((cell['counts'][frontier_cell] <= leaf_size) | (level == self.depth))
+            i_leaf = np.repeat(frontier_q[leaf], cell['counts'][frontier_cell[leaf]])
+            j_leaf = spatial_tools.expand_ranges(cell['starts'][frontier_cell[leaf]], cell['counts'][frontier_cell[leaf]])
+            d_ij = self.points[:,j_leaf] - queries[:,i_leaf]
+            dist = np.linalg.norm(d_ij, axis=0)
+            keep = (dist >= exclude) & (dist < radius[i_leaf]) & (j_leaf != self_sorted[i_leaf])
+            i_leaf, j_leaf, d_ij, dist = i_leaf[keep], j_leaf[keep], d_ij[:,keep], dist[keep]
+            count += np.bincount(i_leaf, None, nQueries)
+            sum_q += bin_sum(i_leaf, self.points[:,j_leaf], nQueries)
+            sum_p += bin_sum(i_leaf, self.velos[:,j_leaf], nQueries)
+            sum_unit += bin_sum(i_leaf, np.divide(d_ij, dist), nQueries)
+            sum_inv_sqr += bin_sum(i_leaf, np.divide(d_ij, dist**2), nQueries)
+
+            # open the rest (search their children at the next level)
+            opened = rest & ~leaf
+            frontier_q = np.repeat(frontier_q[opened], cell['child_counts'][frontier_cell[opened]])
+            frontier_cell = spatial_tools.expand_ranges(cell['child_starts'][frontier_cell[opened]], cell['child_counts'][frontier_cell[opened]])
+
+        return {'count': count, 'sum_q': sum_q, 'sum_p': sum_p, 'sum_unit': sum_unit, 'sum_inv_sqr': sum_inv_sqr}
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module implements parameter packs for the Olfati-Saber style tactics (saber, pinning)
+
+The gains and ranges of a tactic are held together in one object, along with
+the constants derived from them (e.g. c, sigma_norm(r), sigma_norm(d)), which are
+computed once and only recomputed after a gain/range changes. The swarm-level
+kernels take a pack as an argument, so several configurations can coexist.
+
+Usage:
+
+    params = lattice_params(a = 0.5, b = 0.5, eps = 0.1, h = 0.9, ...)
+    params.r_a                      # derived (cached)
+    params.c1_a = 3                 # changing a gain clears the derived constants
+    params_2 = params.copy(d = 3)   # another configuration
+
+Lookup tables:
+
+    With lookup = 1, the pair functions of the sigma norm z (a_ij, phi_a, b_ik, phi_b)
+    are read from tables of lookup_size points over their support (0 to r_a, or 0 
+    to d_b; all are zero beyond), with linear interpolation. The error of linear 
+    interpolation is at most dz^2/8*max|f''|, which we estimate from the second 
+    differences of each table (see table_errors). For the default parameters and
+    4096 points, this is on the order of 1e-6 or less.
+
+@author: tjards
+"""
+
+import numpy as np
+
+#%% Shared functions
+# ------------------
+
+# bump function (applied elementwise, to scalars or arrays), optionally in place
+# note: this is the one implementation, the tactics (saber_tools, pinning_tools) delegate here
+# note: clipping the argument of the cosine to [0,1] gives 1 below h and 0 above 1
+def rho_h(z, h, out = None):
+    z = np.asarray(z, dtype = float)
+    # zero for negative arguments (never the case for sigma norms), found before out overwrites z
+    negative = z < 0 if z.size and z.min() < 0 else None
+    if out is None:
+        out = np.empty(z.shape)
+    np.subtract(z, h, out = out)
+    np.divide(out, 1-h, out = out)
+    np.clip(out, 0, 1, out = out)
+    np.multiply(out, np.pi, out = out)
+    np.cos(out, out = out)
+    np.add(out, 1, out = out)
+    np.multiply(out, 0.5, out = out)
+    if negative is not None:
+        out[negative] = 0
+    return out[()]
+
+#%% Parameter pack
+# ----------------
+
+class lattice_params:
+
+    # names of the gains and ranges (everything else is derived)
+    names = ['a', 'b', 'eps', 'h', 'c1_a', 'c2_a', 'c1_b', 'c2_b', 'c1_g', 'c2_g', 'd', 'r', 'd_prime', 'r_prime', 'maxAlt', 'lookup', 'lookup_size']
+    
+    # settings that have default values
+    defaults = {'lookup': 0,            # use lookup tables for pair functions (0 = no, 1 = yes)
+                'lookup_size': 4096}    # number of points in each table
+
+    # initializes the pack
+    def __init__(self, **kwargs):
+
+        object.__setattr__(self, 'derived', {})
+        for name in self.names:
+            setattr(self, name, kwargs.pop(name, self.defaults.get(name)))
+        if any(getattr(self, name) is None for name in self.names):
+            raise Exception('Missing parameter(s): ', [name for name in self.names if getattr(self, name) is None])
+        if kwargs:
+            raise Exception('Unknown parameter(s): ', list(kwargs.keys()))
+
+    # any change to a gain/range invalidates the derived constants
+    def __setattr__(self, name, value):
+
+        if name not in self.names:
+            raise Exception('Unknown parameter: ', name)
+        object.__setattr__(self, name, value)
+        self.derived.clear()
+
+    # a new pack, with some gains/ranges changed
+    def copy(self, **kwargs):
+
+        values = {name: getattr(self, name) for name in self.names}
+        values.update(kwargs)
+        return lattice_params(**values)
+
+    # computes a derived constant (only if required)
+    def derive(self, name, compute):
+
+        if name not in self.derived:
+            self.derived[name] = compute()
+        return self.derived[name]
+
+    # useful functions
+    # ----------------
+
+    # sigma norm, from the (euclidean) norm
+    def sigma_norm(self, norm):
+        return (1/self.eps)*(np.sqrt(1+self.eps*np.square(norm))-1)
+
+    # derived constants
+    # -----------------
+
+    @property
+    def c(self):
+        return self.derive('c', lambda: np.divide(np.abs(self.a-self.b),np.sqrt(4*self.a*self.b)))
+
+    @property
+    def r_a(self):
+        return self.derive('r_a', lambda: self.sigma_norm(self.r))          # lattice separation (sensor range)
+
+    @property
+    def d_a(self):
+        return self.derive('d_a', lambda: self.sigma_norm(self.d))          # lattice separation (goal)
+
+    @property
+    def d_b(self):
+        return self.derive('d_b', lambda: self.sigma_norm(self.d_prime))    # obstacle separation (goal range)
+
+    # functions (applied elementwise)
+    # -------------------------------
+
+    def sigma_1(self, z):
+        return np.divide(z,np.sqrt(1+z**2))
+
+    # bump function
+    def rho_h(self, z):
+        return rho_h(z, self.h)
+
+    # action function
+    def phi(self, z):
+        return 0.5*((self.a+self.b)*self.sigma_1(z+self.c)+(self.a-self.b))
+
+    # pair functions, of the sigma norm z (exact)
+    # -------------------------------------------
+
+    # adjacency between a-agents
+    def a_ij_exact(self, z):
+        return self.rho_h(z/self.r_a)
+
+    # action function between a-agents
+    def phi_a_exact(self, z):
+        return self.rho_h(z/self.r_a)*self.phi(z-self.d_a)
+
+    # adjacency between a- and b-agents
+    def b_ik_exact(self, z):
+        return self.rho_h(z/self.d_b)
+
+    # action function between a- and b-agents
+    def phi_b_exact(self, z):
+        return self.rho_h(z/self.d_b)*(self.sigma_1(z-self.d_b)-1)
+
+    # lookup tables
+    # -------------
+
+    # builds a table for a function over [0, z_max], with its error bound
+    def build_table(self, func, z_max):
+        z = np.linspace(0, z_max, self.lookup_size)
+        f = func(z)
+        error = np.max(np.abs(f[0:-2] - 2*f[1:-1] + f[2:]), initial=0)/8
+        return z, f, error
+
+    @property
+    def tables(self):
+        return self.derive('tables', lambda: {
+            'a_ij':  self.build_table(self.a_ij_exact, self.r_a),
+            'phi_a': self.build_table(self.phi_a_exact, self.r_a),
+            'b_ik':  self.build_table(self.b_ik_exact, self.d_b),
+            'phi_b': self.build_table(self.phi_b_exact, self.d_b)})
+
+    # estimated max error of each table (from linear interpolation)
+    def table_errors(self):
+        return {name: table[2] for name, table in self.tables.items()}
+
+    # reads from a table (zero outside of it)
+    def read_table(self, name, z):
+        z_table, f_table, _ = self.tables[name]
+        return np.interp(z, z_table, f_table, left=0, right=0)
+
+    # pair functions, of the sigma norm z
+    # -----------------------------------
+
+    def a_ij(self, z):
+        return self.read_table('a_ij', z) if self.lookup else self.a_ij_exact(z)
+
+    def phi_a(self, z):
+        return self.read_table('phi_a', z) if self.lookup else self.phi_a_exact(z)
+
+    def b_ik(self, z):
+        return self.read_table('b_ik', z) if self.lookup else self.b_ik_exact(z)
+
+    def phi_b(self, z):
+        return self.read_table('phi_b', z) if self.lookup else self.phi_b_exact(z)
@@ -35,6 +35,7 @@ Dev notes:
     03 Apr 2023 - add heuristic to the betweenness Djikstra for moving towards other components during merge?
     03 Apr 2023 - focus on low degree centrality nodes as drivers? low betweenness? hmm... invert typical logic
     08 Apr 2023 - there is a lot of inefficiency in below, move the A,D,G calcs outside the loops
+        (A is now computed once, and sliced for each component)
     
 """
 
@@ -43,6 +44,7 @@ Dev notes:
 import numpy as np
 import random
 from utils import graph_tools as grph
+from utils import saber_tools, param_tools
 
 #%% Hyperparameters
 # -----------------
@@ -53,6 +55,8 @@ r       = 1.2*d         # range at which neighbours can be sensed
 d_prime = 0.6*d         # desired separation 
 r_prime = 1.2*d_prime   # range at which obstacles can be sensed
 rg = d                  # range for graph analysis (nominally, d)
+maxAlt  = 10            # TRAVIS: maxAlt is for testing, only enforces walls below this altitude
+lookup  = 0             # use lookup tables for the pair functions in the swarm-level kernels (0 = exact, 1 = tables, see param_tools)
 
 # gains
 c1_a = 1                # cohesion
@@ -77,6 +81,12 @@ eps = 0.1
 h   = 0.2
 pi  = 3.141592653589793
 
+# parameter pack used by the swarm-level kernels (derived constants are cached)
+# note: to change a gain/range at runtime, set it here (e.g. default_params.c1_a = 3)
+default_params = param_tools.lattice_params(a = a, b = b, eps = eps, h = h, 
+                                            c1_a = c1_a, c2_a = c2_a, c1_b = c1_b, c2_b = c2_b, c1_g = c1_g, c2_g = c2_g, 
+                                            d = d, r = r, d_prime = d_prime, r_prime = r_prime, maxAlt = maxAlt, lookup = lookup)
+
 #%% Useful functions
 # ----------------
 
@@ -85,13 +95,8 @@ def sigma_norm(z):
     return norm_sig
 
 def rho_h(z):    
-    if 0 <= z < h:
-        rho_h = 1        
-    elif h <= z < 1:
-        rho_h = 0.5*(1+np.cos(pi*np.divide(z-h,1-h)))    
-    else:
-        rho_h = 0  
-    return rho_h
+    # applied elementwise (scalars or arrays), see param_tools
+    return param_tools.rho_h(z, h)
  
 def phi_a(q_i, q_j, r_a, d_a): 
     z = sigma_norm(q_j-q_i)        
@@ -147,6 +152,13 @@ def compute_cmd_a(states_q, states_p, targets, targets_v, k_node):
 
     return u_int[:,k_node] 
 
+# form the lattice (whole swarm, sparse neighbours)
+# note: same kernel as saber, with the pinning parameters
+def compute_cmd_a_pairs(states_q, states_p, nbrs, params = None):
+    if params is None:
+        params = default_params
+    return saber_tools.compute_cmd_a_pairs(states_q, states_p, nbrs, params)
+
 # avoid obstacles
 def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
       
@@ -168,7 +180,7 @@ def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
         mu = np.divide(obstacles[3, k_obstacle],normo)
         # compute bold_a_k (for the projection matrix)
         bold_a_k = np.divide(states_q[:,k_node]-obstacles[0:3,k_obstacle],normo)
-        bold_a_k = np.array(bold_a_k, ndmin = 2)
+        bold_a_k = np.array(bold_a_k, ndmin = 2).transpose()
         # compute projection matrix
         P = np.identity(states_p.shape[0]) - np.dot(bold_a_k,bold_a_k.transpose())
         # compute beta-agent position and velocity
@@ -194,12 +206,18 @@ def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
         # compute distance to beta-agent
         dist_b = np.linalg.norm(q_ik-states_q[:,k_node])
         # if it is with the beta range
-        maxAlt = 10 # TRAVIS: maxAlt is for testing, only enforces walls below this altitude
         if dist_b < r_prime and states_q[2,k_node] < maxAlt:
             p_ik = np.dot(P,states_p[:,k_node])
             u_obs[:,k_node] += c1_b*phi_b(states_q[:,k_node], q_ik, d_b)*n_ij(states_q[:,k_node], q_ik) + c2_b*b_ik(states_q[:,k_node], q_ik, d_b)*(p_ik - states_p[:,k_node])
 
         return u_obs[:,k_node] 
+
+# avoid obstacles (whole swarm)
+# note: same kernel as saber, with the pinning parameters
+def compute_cmd_b_all(states_q, states_p, obstacles, walls, params = None):
+    if params is None:
+        params = default_params
+    return saber_tools.compute_cmd_b_all(states_q, states_p, obstacles, walls, params)
     
 # track the target
 def compute_cmd_g(states_q, states_p, targets, targets_v, k_node, pin_matrix):
@@ -212,6 +230,21 @@ def compute_cmd_g(states_q, states_p, targets, targets_v, k_node, pin_matrix):
   
     return u_nav[:,k_node]
 
+# navigation command (whole swarm)
+# --------------------------------
+# note: same as compute_cmd_g, but for all agents at once (returns 3 x N)
+def compute_cmd_g_all(states_q, states_p, targets, targets_v, pin_matrix, params = None):
+
+    # initialize 
+    if params is None:
+        params = default_params
+    pins = np.diag(pin_matrix)
+
+    # note: the pin matrix "activates" the pins for target tracking (1 = pin)
+    u_nav = - pins*params.c1_g*params.sigma_1(states_q-targets)- pins*params.c2_g*(states_p - targets_v)
+  
+    return u_nav
+
 # consolidate control signals
 def compute_cmd(centroid, states_q, states_p, obstacles, walls, targets, targets_v, k_node, pin_matrix):
     
@@ -248,11 +281,11 @@ def select_pins_components(states_q):
     # initialize the pins
     pin_matrix = np.zeros((states_q.shape[1],states_q.shape[1]))
     
-    # compute adjacency matrix
-    A = grph.adj_matrix(states_q, rg)
+    # compute adjacency matrix (once, sparse, components use slices of this)
+    A_all = grph.adj_matrix(states_q, rg, as_sparse=True)
     
     # find the components of the graph
-    components = grph.find_connected_components_A(A)
+    components = grph.find_connected_components_sparse(A_all)
     
     # Gramian method
     # --------------
@@ -262,9 +295,8 @@ def select_pins_components(states_q):
         for i in range(0,len(components)):
             
             # find the adjacency and degree matrix of this component 
-            states_i = states_q[:,components[i]]
-            A = grph.adj_matrix(states_i, rg)  # move these outside (efficiency)
-            D = grph.deg_matrix(states_i, rg)
+            A = A_all[components[i],:][:,components[i]].toarray()
+            D = grph.deg_matrix_A(A)
             
             index_i = components[i][0]
             
@@ -302,9 +334,8 @@ def select_pins_components(states_q):
         # for each component
         for i in range(0,len(components)):
             
-            # find the adjacency and degree matrix of this component 
-            states_i = states_q[:,components[i]]
-            D = grph.deg_matrix(states_i, rg)
+            # find the degree matrix of this component 
+            D = grph.deg_matrix_A(A_all[components[i],:][:,components[i]].toarray())
             
             index_i = components[i][0]
             
@@ -316,7 +347,7 @@ def select_pins_components(states_q):
             else: 
                 
                 # find index of highest element of Degree matrix
-                index_i = np.argmax(np.diag(D))
+                index_i = components[i][np.argmax(np.diag(D))]
                 # set as default pin
                 pin_matrix[index_i,index_i]=1
                 
@@ -327,6 +358,9 @@ def select_pins_components(states_q):
     
     elif method == 'between':
         
+        # build the graph once (look slighly outside lattice range), components use slices of this
+        A_between = grph.adj_matrix(states_q, rg+0.1, as_sparse=True)
+        
         # for each component
         for i in range(0,len(components)):
             
@@ -340,14 +374,12 @@ def select_pins_components(states_q):
             
             # else, we have enough to do betweenness
             else:         
-                # pull out the states for this component 
-                states_i = states_q[:,components[i]]
-                # build a graph within this component (look slighly outside lattice range)
-                G = grph.build_graph(states_i,rg+0.1) 
+                # pull out the graph within this component 
+                A_i = A_between[components[i],:][:,components[i]]
                 # find the max influencer
-                B = grph.betweenness(G)
-                index_ii = max(B, key=B.get)
-                #index_ii = min(B, key=B.get)
+                B = grph.betweenness_A(A_i)
+                index_ii = np.argmax(B)
+                #index_ii = np.argmin(B)
                 index_i = components[i][index_ii]
                 # pin the max influencers
                 pin_matrix[index_i,index_i] = 1
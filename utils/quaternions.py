@@ -20,6 +20,15 @@ def rotate(q, p1):
     p2 = quat_mult(quat_mult(q, np.append([0.0],p1)), quatjugate(q))[1:]
     return p2
 
+# rotation matrix for (unit) quaternion q
+# s.t. rotate(q, p1) = R p1, which also rotates many points at once (3 x N)
+# -----------------------------------------------------------------------
+def quat2rot(q):
+    w, x, y, z = q
+    return np.array([[1-2*(y**2+z**2), 2*(x*y-w*z), 2*(x*z+w*y)],
+                     [2*(x*y+w*z), 1-2*(x**2+z**2), 2*(y*z-w*x)],
+                     [2*(x*z-w*y), 2*(y*z+w*x), 1-2*(x**2+y**2)]])
+
 # quaternion conjugate
 # where q = [qw qx qy qz]^T
 # -------------------------
@@ -78,6 +87,56 @@ def q2e(quat):
 
 
 
+#%% Batched rotations
+# -------------------
+# note: quatjugate, quat_mult and e2q also work on many quaternions at once, 
+# stored as columns (4 x N). The functions below rotate many vectors (3 x N) 
+# at once, either by one quaternion (4,) or by one quaternion per vector (4 x N).
+# Identity quaternions (no rotation) and twists about the x-axis only (as used 
+# for the lemniscates) skip the full rotation matrix.
+
+cache_size = 64     # max number of rotation matrices kept (cleared when full)
+rot_cache = {}      # rotation matrices, by quaternion
+
+# rotation matrix for quaternion q (cached)
+# -----------------------------------------
+def quat2rot_cached(q):
+    key = np.asarray(q, dtype=float).tobytes()
+    if key not in rot_cache:
+        if len(rot_cache) >= cache_size:
+            rot_cache.clear()
+        rot_cache[key] = quat2rot(q)
+    return rot_cache[key]
+
+# rotate p about the x-axis only (q = [qw qx 0 0]^T)
+# --------------------------------------------------
+def rotate_x(q, p):
+    w, x = q[0], q[1]
+    c = 1-2*x**2
+    s = 2*w*x
+    p2 = np.array(p, dtype=float)
+    p2[1] = c*p[1]-s*p[2]
+    p2[2] = s*p[1]+c*p[2]
+    return p2
+
+# rotate many vectors p (3 x N) by one quaternion q (4,)
+# -------------------------------------------------------
+def rotate_many(q, p):
+    if not np.any(q[1:4]):
+        return np.array(p, dtype=float)
+    if not np.any(q[2:4]):
+        return rotate_x(q, p)
+    return quat2rot_cached(q) @ p
+
+# rotate each vector p (3 x N) by its own quaternion q (4 x N)
+# -------------------------------------------------------------
+def rotate_each(q, p):
+    if not np.any(q[1:4]):
+        return np.array(p, dtype=float)
+    if not np.any(q[2:4]):
+        return rotate_x(q, p)
+    return np.einsum('ijn,jn->in', quat2rot(q), p)
+
 #%% Example
 
 # # vector to be rotated
@@ -10,6 +10,8 @@ This program implements Reynolds Rules of Flocking ("boids")
 """
 
 import numpy as np
+from scipy.spatial.distance import pdist, squareform
+from utils import neighbour_tools as nbr_tools
 
 # Hyperparameters
 # ----------------
@@ -49,14 +51,20 @@ def order(states_q):
     
     # to find the radius that includes min number of agents
     if mode_min_coh == 1:
-        slide = 0
-        for k_node in range(states_q.shape[1]):
-            #slide += 1
-            for k_neigh in range(slide,states_q.shape[1]):
-                if k_node != k_neigh:
-                    distances[k_node,k_neigh] = np.linalg.norm(states_q[:,k_node]-states_q[:,k_neigh])
+        distances = squareform(pdist(states_q.transpose()))
     return distances 
 
+# cohesion range of each agent, to include min number of agents (from distances, N x N)
+# note: the distance to the (agents_min_coh+1)-th nearest, found by partial selection 
+def cohesion_range(distances):
+    
+    # make sure the number of vehicles is bigger than the min number of agents 
+    if distances.shape[0] < agents_min_coh+2:
+        raise Exception('There are an insufficient number of agents for the cohesion mode selected. Minimum number of agents for mode ',agents_min_coh ,' is ', agents_min_coh+2, ' and you have selected ', distances.shape[0] )
+    
+    # take the distance of the farthest agent that satisfies min count (counting itself, at 0)
+    return np.partition(distances, agents_min_coh+1, axis=-1)[...,agents_min_coh+1]
+
 # Compute commands
 # ----------------
 
@@ -83,19 +91,7 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, distances):
     
     # adjust cohesion range for min number of agents 
     if mode_min_coh == 1:
-        
-        # make sure the number of vehicles is bigger than the min number of agents 
-        if distances.shape[0] < agents_min_coh+2:
-            raise Exception('There are an insufficient number of agents for the cohesion mode selected. Minimum number of agents for mode ',agents_min_coh ,' is ', agents_min_coh+2, ' and you have selected ', distances.shape[0] )
-    
-        r_coh = 0
-        # pull agent distantces for this node
-        node_ranges = distances[k_node,:]
-        # sort the distances
-        node_ranges_sorted = np.sort(node_ranges)
-        # take the distance of the farthest agent that satisfies min count
-        r_coh_temp = node_ranges_sorted[agents_min_coh+1]
-        r_coh = r_coh_temp
+        r_coh = cohesion_range(distances[k_node,:])
     else:
         # else, just rely on default range
         r_coh = r
@@ -107,9 +103,8 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, distances):
             # compute the euc distance between them
             dist = np.linalg.norm(states_q[:,k_node]-states_q[:,k_neigh])
             
+            # skip any collisions (see collision_tools for logging them)
             if dist < 0.1:
-                # print out any collisions 
-                print('collision at agent: ', k_node)
                 continue
     
             # if agent is within the alignment range
@@ -192,4 +187,120 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, distances):
     cmd_i[:,k_node] = u_coh[:,k_node] + u_ali[:,k_node] + u_sep[:,k_node] + u_nav[:,k_node] 
     
     return cmd_i[:,k_node]
-  
\ No newline at end of file
+  
+# Compute commands (whole swarm)
+# ------------------------------
+# note: same as compute_cmd, but for all agents at once (returns 3 x N)
+
+# norm_sat, applied to each column (3 x N)
+def norm_sat_all(u,maxu):
+    norm1b = np.linalg.norm(u, axis=0)
+    u_out = maxu*np.divide(u,norm1b)
+    return u_out
+
+def compute_cmd_all(targets, centroid, states_q, states_p):
+    
+    nNodes = states_q.shape[1]
+    
+    # sums over the neighbour list (CSR, each pair i < j once, see neighbour_tools)
+    if mode_min_coh == 0:
+        
+        # differences and distances for each pair, where q_ij = q_j - q_i
+        i, j = nbr_tools.to_pairs(nbr_tools.neighbour_list(states_q, max(r, r_prime)))
+        q_ij = states_q[:,j] - states_q[:,i]
+        dist = np.sqrt(np.sum(q_ij**2, axis=0))
+        
+        # skip any collisions (see collision_tools for logging them)
+        in_ali = (dist >= 0.1) & (dist < r)
+        in_sep = (dist >= 0.1) & (dist < r_prime)
+        temp_total = nbr_tools.scatter_sym(in_ali[np.newaxis,:], i, j, nNodes)[0,:]
+        temp_total_prime = nbr_tools.scatter_sym(in_sep[np.newaxis,:], i, j, nNodes)[0,:]
+        
+        # sums over neighbours (agent i sums agent j, and vice versa)
+        sum_poses = np.zeros((3,nNodes))
+        sum_velos = np.zeros((3,nNodes))
+        for dim in range(3):
+            sum_poses[dim,:] = np.bincount(i, states_q[dim,j]*in_ali, nNodes) + np.bincount(j, states_q[dim,i]*in_ali, nNodes)
+            sum_velos[dim,:] = np.bincount(i, states_p[dim,j]*in_ali, nNodes) + np.bincount(j, states_p[dim,i]*in_ali, nNodes)
+        sum_obs = nbr_tools.scatter_antisym(np.divide(q_ij, np.where(in_sep, dist**2, 1))*in_sep, i, j, nNodes)
+    
+    else:
+    
+        # pairwise differences and distances, where q_ij[:,i,j] = q_j - q_i
+        q_ij = states_q[:,np.newaxis,:] - states_q[:,:,np.newaxis]
+        dist = np.sqrt(np.sum(q_ij**2, axis=0))
+        others = ~np.eye(nNodes, dtype=bool)
+        
+        # skip any collisions (see collision_tools for logging them)
+        neighbours = others & (dist >= 0.1)
+        
+        # adjust cohesion range for min number of agents (from the same distances)
+        r_coh = cohesion_range(dist)
+            
+        # ranges (alignment and cohesion share the same range)
+        in_ali = neighbours & (dist < np.maximum(r,r_coh)[:,np.newaxis])
+        in_sep = neighbours & (dist < r_prime)
+        temp_total = np.sum(in_ali, axis=1)
+        temp_total_prime = np.sum(in_sep, axis=1)
+        
+        # sums over neighbours 
+        sum_poses = np.sum(states_q[:,np.newaxis,:]*in_ali, axis=2)
+        sum_velos = np.sum(states_p[:,np.newaxis,:]*in_ali, axis=2)
+        dist_sqr = np.where(in_sep, dist**2, 1)
+        sum_obs = np.sum(np.divide(q_ij,dist_sqr)*in_sep, axis=2)
+    
+    # norms
+    # -----
+    norm_coh = np.linalg.norm(sum_poses, axis=0)
+    norm_ali = np.linalg.norm(sum_velos, axis=0)
+    norm_sep = np.linalg.norm(sum_obs, axis=0)
+    
+    # only where the terms are defined (same as compute_cmd)
+    do_coh = (temp_total != 0) & (norm_coh != 0)
+    do_ali = (temp_total != 0) & (norm_ali != 0)
+    do_sep = (temp_total_prime != 0) & (norm_sep != 0)
+    u_coh = np.zeros((3,nNodes))
+    u_ali = np.zeros((3,nNodes))
+    u_sep = np.zeros((3,nNodes))
+    
+    # Cohesion
+    # --------
+    temp_u_coh = (maxv*np.divide(((np.divide(sum_poses[:,do_coh],temp_total[do_coh]) - states_q[:,do_coh])),norm_coh[do_coh])-states_p[:,do_coh])
+    u_coh[:,do_coh] = cd_1*norm_sat_all(temp_u_coh,maxu)
+    
+    # Alignment
+    # ---------
+    temp_u_ali = (maxv*np.divide((np.divide(sum_velos[:,do_ali],temp_total[do_ali])),norm_ali[do_ali])-states_p[:,do_ali])
+    u_ali[:,do_ali] = cd_2*norm_sat_all(temp_u_ali,maxu)
+    
+    # Separation
+    # ----------
+    temp_u_sep = (maxv*np.divide(((np.divide(sum_obs[:,do_sep],temp_total_prime[do_sep]))),norm_sep[do_sep])-states_p[:,do_sep]) 
+    u_sep[:,do_sep] = -cd_3*norm_sat_all(temp_u_sep,maxu)
+    
+    # Tracking
+    # -------- 
+    cd_4 = cd_track*np.ones(nNodes)
+    centroid = np.reshape(centroid,(3,1))
+    
+    # if doing recovery
+    if recovery == 1:
+        # and if far away, adjust gain to drive back
+        cd_4[np.linalg.norm(centroid-states_q, axis=0) > far_away] = 0.3 # overides set value, so recovery is always a low gain
+        
+    # if escorting, track the target (overrides recovery actions)
+    if escort == 1:
+        cd_4[:] = cd_track
+        if cd_track == 0:
+            print('WARNING: no gain set for tracking target, please set a gain > 0')
+        temp_u_nav = (targets-states_q)
+    else:
+        temp_u_nav = (centroid-states_q)
+    
+    # compute tracking 
+    u_nav = cd_4*norm_sat_all(temp_u_nav,maxu)
+    
+    # compute consolidated commands
+    cmd = u_coh + u_ali + u_sep + u_nav
+    
+    return cmd
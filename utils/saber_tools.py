@@ -12,6 +12,9 @@ Created on Sat Sep 11 10:17:52 2021
 #%% Import stuff
 # ------------
 import numpy as np
+from utils import neighbour_tools as nbr_tools
+from utils import param_tools
+from utils import graph_tools as grph
 
 
 #%% Hyperparameters
@@ -39,6 +42,17 @@ d       = 2             # lattice scale (Saber flocking, distance between a-agen
 r       = 2*d           # range at which neighbours can be sensed (Saber flocking, interaction range of a-agents)
 d_prime = 0.5 #0.6*d      # desired separation (Saber flocking, distance between a- and b-agents)
 r_prime = 2*2*d_prime     # range at which obstacles can be sensed, (Saber flocking, interaction range of a- and b-agents)
+maxAlt  = 10            # TRAVIS: maxAlt is for testing, only enforces walls below this altitude
+lookup  = 0             # use lookup tables for the pair functions in the swarm-level kernels (0 = exact, 1 = tables, see param_tools)
+alignment = 'pairs'     # how to compute the alignment (velocity consensus) term in compute_cmd_a_pairs
+                            # pairs = scatter a_ij*(p_j - p_i) by pairs
+                            # laplacian = -L p, with the weighted Laplacian as a sparse matrix (see graph_tools)
+
+# parameter pack used by the swarm-level kernels (derived constants are cached)
+# note: to change a gain/range at runtime, set it here (e.g. default_params.c1_a = 3)
+default_params = param_tools.lattice_params(a = a, b = b, eps = eps, h = h, 
+                                            c1_a = c1_a, c2_a = c2_a, c1_b = c1_b, c2_b = c2_b, c1_g = c1_g, c2_g = c2_g, 
+                                            d = d, r = r, d_prime = d_prime, r_prime = r_prime, maxAlt = maxAlt, lookup = lookup)
 
 
 #%% Useful functions
@@ -61,13 +75,8 @@ def sigma_1(z):
     return sigma_1
 
 def rho_h(z):    
-    if 0 <= z < h:
-        rho_h = 1        
-    elif h <= z < 1:
-        rho_h = 0.5*(1+np.cos(pi*np.divide(z-h,1-h)))    
-    else:
-        rho_h = 0  
-    return rho_h
+    # applied elementwise (scalars or arrays), see param_tools
+    return param_tools.rho_h(z, h)
  
 def phi_a(q_i, q_j, r_a, d_a): 
     z = sigma_norm(q_j-q_i)        
@@ -96,6 +105,82 @@ def norm_sat(u,maxu):
     u_out = maxu*np.divide(u,norm1b)
     return u_out
 
+#%% Useful functions (whole swarm)
+# --------------------------------
+
+# pairwise differences and distances, where q_ij[:,i,j] = q_j - q_i
+def pairwise(states_q):
+    q_ij = states_q[:,np.newaxis,:] - states_q[:,:,np.newaxis]
+    dist = np.sqrt(np.sum(q_ij**2, axis=0))
+    return q_ij, dist
+
+# beta-agents for every agent against every obstacle (spheres) and wall (planes)
+# returns positions and velocities (3 x N x K, with K = nObs + nWalls), along  
+# with a mask excluding agents that overlap an obstacle
+def beta_agents(states_q, states_p, obstacles, walls):
+    
+    q_i = states_q[:,:,np.newaxis]
+    p_i = states_p[:,:,np.newaxis]
+    
+    # spheres
+    # -------
+    q_io = q_i - obstacles[0:3,np.newaxis,:]
+    normo = np.sqrt(np.sum(q_io**2, axis=0))
+    valid_obs = normo >= 0.2                        # ignore if overlapping
+    normo = np.where(valid_obs, normo, 1)
+    mu = np.divide(obstacles[3,np.newaxis,:],normo)
+    bold_a_k = np.divide(q_io,normo)
+    # beta-agent position: mu*q_i + (1-mu)*y_k
+    q_ik_obs = q_i - (1-mu)*q_io
+    # beta-agent velocity: mu*P*p_i, where P = I - a_k*a_k^T
+    p_ik_obs = mu*(p_i - bold_a_k*np.sum(bold_a_k*p_i, axis=0))
+    
+    # walls
+    # -----
+    bold_a_k = np.divide(walls[0:3,:],np.linalg.norm(walls[0:3,:], axis=0))[:,np.newaxis,:]
+    q_iw = q_i - walls[3:6,np.newaxis,:]
+    # beta-agent position: P*q_i + (I-P)*y_k
+    q_ik_walls = q_i - bold_a_k*np.sum(bold_a_k*q_iw, axis=0)
+    # beta-agent velocity: P*p_i
+    p_ik_walls = p_i - bold_a_k*np.sum(bold_a_k*p_i, axis=0)
+    valid_walls = np.ones((states_q.shape[1],walls.shape[1]), dtype=bool)
+    
+    q_ik = np.concatenate((q_ik_obs, q_ik_walls), axis=2)
+    p_ik = np.concatenate((p_ik_obs, p_ik_walls), axis=2)
+    valid = np.concatenate((valid_obs, valid_walls), axis=1)
+    
+    return q_ik, p_ik, valid
+
+# buffers reused between steps by the fused controller (only reallocated to grow)
+class workspace:
+
+    # initializes an (empty) workspace
+    def __init__(self):
+        self.buffers = {}
+        self.nAllocs = 0    # number of (re)allocations (for diagnostics)
+
+    # a buffer of this shape (contents are left over from the last use)
+    def get(self, name, shape, dtype = float):
+        size = int(np.prod(shape))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            # grow geometrically, so that a slowly growing neighbour list does not reallocate every step
+            buffer = np.empty(max(size, 2*buffer.size if buffer is not None else 0), dtype = dtype)
+            self.buffers[name] = buffer
+            self.nAllocs += 1
+        return buffer[:size].reshape(shape)
+
+# action function phi(z - d_a), in place (denom is a second buffer, same shape)
+def phi_into(z, params, out, denom):
+    np.subtract(z, params.d_a - params.c, out = out)
+    np.multiply(out, out, out = denom)
+    np.add(denom, 1, out = denom)
+    np.sqrt(denom, out = denom)
+    np.divide(out, denom, out = out)
+    np.multiply(out, 0.5*(params.a+params.b), out = out)
+    np.add(out, 0.5*(params.a-params.b), out = out)
+    return out
+
 #%% Main functions
 # ----------------
 
@@ -123,6 +208,74 @@ def compute_cmd_a(states_q, states_p, targets, targets_v, k_node):
 
     return u_int[:,k_node]     
 
+# interaction command (whole swarm)
+# ---------------------------------
+# note: same as compute_cmd_a, but for all agents at once (returns 3 x N)
+def compute_cmd_a_all(states_q, states_p, params = None):
+    
+    # initialize 
+    if params is None:
+        params = default_params
+    
+    # pairwise differences in position and velocity 
+    q_ij, dist = pairwise(states_q)
+    p_ij = states_p[:,np.newaxis,:] - states_p[:,:,np.newaxis]
+    
+    # neighbours within the interaction range (except for itself)
+    in_range = dist < params.r
+    np.fill_diagonal(in_range, False)
+    
+    # sigma norm and its gradient denominator (shared by n_ij)
+    root = np.sqrt(1+params.eps*dist**2)
+    z = (1/params.eps)*(root-1)
+    
+    # adjacency (a_ij) and action function (phi_a) for each pair 
+    a = params.a_ij(z)*in_range
+    phi_a = params.phi_a(z)*in_range
+    
+    # Lattice Flocking term (phi_alpha), summed over neighbours
+    # --------------------------------------------------------
+    u_int = params.c1_a*np.sum(phi_a*np.divide(q_ij,root), axis=2) + params.c2_a*np.sum(a*p_ij, axis=2)
+
+    return u_int
+
+# interaction command (whole swarm, sparse neighbours)
+# ----------------------------------------------------
+# note: same as compute_cmd_a_all, but only evaluates the pairs in the 
+# neighbour list (see neighbour_tools), once per symmetric pair 
+def compute_cmd_a_pairs(states_q, states_p, nbrs, params = None):
+    
+    # initialize 
+    if params is None:
+        params = default_params
+    i, j = nbr_tools.to_pairs(nbrs)
+    
+    # differences in position and velocity, for each pair
+    q_ij = states_q[:,j] - states_q[:,i]
+    p_ij = states_p[:,j] - states_p[:,i]
+    dist = np.sqrt(np.sum(q_ij**2, axis=0))
+    
+    # sigma norm and its gradient denominator (shared by n_ij)
+    root = np.sqrt(1+params.eps*dist**2)
+    z = (1/params.eps)*(root-1)
+    
+    # adjacency (a_ij) and action function (phi_a) for each pair 
+    a = params.a_ij(z)
+    phi_a = params.phi_a(z)
+    
+    # both terms are antisymmetric in (i,j), so scatter +/- to each agent
+    if alignment == 'laplacian':
+        # gradient term by pairs, then alignment as -L p, with weighted adjacency a_ij
+        f_ij = params.c1_a*phi_a*np.divide(q_ij,root)
+        u_int = nbr_tools.scatter_antisym(f_ij, i, j, states_q.shape[1])
+        L = grph.lap_matrix_sparse(grph.adj_matrix_sparse(i, j, states_q.shape[1], a))
+        u_int -= params.c2_a*(L @ states_p.transpose()).transpose()
+    else:
+        f_ij = params.c1_a*phi_a*np.divide(q_ij,root) + params.c2_a*a*p_ij
+        u_int = nbr_tools.scatter_antisym(f_ij, i, j, states_q.shape[1])
+
+    return u_int
+
 # navigation command
 # ------------------
 def compute_cmd_g(states_q, states_p, targets, targets_v, k_node):
@@ -136,6 +289,21 @@ def compute_cmd_g(states_q, states_p, targets, targets_v, k_node):
   
     return u_nav[:,k_node]
 
+# navigation command (whole swarm)
+# --------------------------------
+# note: same as compute_cmd_g, but for all agents at once (returns 3 x N)
+def compute_cmd_g_all(states_q, states_p, targets, targets_v, params = None):
+
+    # initialize 
+    if params is None:
+        params = default_params
+
+    # Navigation term (phi_gamma)
+    # ---------------------------
+    u_nav = - params.c1_g*params.sigma_1(states_q-targets)-params.c2_g*(states_p - targets_v)
+  
+    return u_nav
+
 # obstacle avoidance command
 # --------------------------
 def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
@@ -160,7 +328,7 @@ def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
         mu = np.divide(obstacles[3, k_obstacle],normo)
         # compute bold_a_k (for the projection matrix)
         bold_a_k = np.divide(states_q[:,k_node]-obstacles[0:3,k_obstacle],normo)
-        bold_a_k = np.array(bold_a_k, ndmin = 2)
+        bold_a_k = np.array(bold_a_k, ndmin = 2).transpose()
         # compute projection matrix
         P = np.identity(states_p.shape[0]) - np.dot(bold_a_k,bold_a_k.transpose())
         # compute beta-agent position and velocity
@@ -186,9 +354,127 @@ def compute_cmd_b(states_q, states_p, obstacles, walls, k_node):
         # compute distance to beta-agent
         dist_b = np.linalg.norm(q_ik-states_q[:,k_node])
         # if it is with the beta range
-        maxAlt = 10 # TRAVIS: maxAlt is for testing, only enforces walls below this altitude
         if dist_b < r_prime and states_q[2,k_node] < maxAlt:
             p_ik = np.dot(P,states_p[:,k_node])
             u_obs[:,k_node] += c1_b*phi_b(states_q[:,k_node], q_ik, d_b)*n_ij(states_q[:,k_node], q_ik) + c2_b*b_ik(states_q[:,k_node], q_ik, d_b)*(p_ik - states_p[:,k_node])
 
-        return u_obs[:,k_node] 
\ No newline at end of file
+        return u_obs[:,k_node] 
+
+# obstacle avoidance command (whole swarm)
+# ----------------------------------------
+# note: same as compute_cmd_b, but for all agents, obstacles and walls at once (returns 3 x N)
+def compute_cmd_b_all(states_q, states_p, obstacles, walls, params = None):
+    
+    # initialize 
+    if params is None:
+        params = default_params
+    nObs = obstacles.shape[1]
+    
+    # compute all the beta-agents
+    q_ik, p_ik, valid = beta_agents(states_q, states_p, obstacles, walls)
+    q_ik = q_ik - states_q[:,:,np.newaxis]
+    p_ik = p_ik - states_p[:,:,np.newaxis]
+    dist_b = np.sqrt(np.sum(q_ik**2, axis=0))
+    
+    # only those within the beta range (and walls below max altitude)
+    active = valid & (dist_b < params.r_prime)
+    active[:,nObs:] &= (states_q[2,:] < params.maxAlt)[:,np.newaxis]
+    
+    # sigma norm and its gradient denominator (shared by n_ij)
+    root = np.sqrt(1+params.eps*dist_b**2)
+    z = (1/params.eps)*(root-1)
+    
+    # b_ik and phi_b for each agent/obstacle pair
+    b = params.b_ik(z)*active
+    phi_b = params.phi_b(z)*active
+    
+    # Obstacle Avoidance term (phi_beta), summed over obstacles and walls
+    # ------------------------------------------------------------------
+    u_obs = params.c1_b*np.sum(phi_b*np.divide(q_ik,root), axis=2) + params.c2_b*np.sum(b*p_ik, axis=2)
+    
+    return u_obs
+
+# fused controller (whole swarm)
+# ------------------------------
+# note: computes the lattice (alpha), obstacle (beta) and navigation (gamma) terms
+# in one pass (returns 3 x N, same as the sum of the separate kernels). The pair 
+# differences, norms and weights are computed once and shared by the terms, in 
+# buffers from the workspace (persist one between steps), and the result is 
+# written into out (if provided). The neighbour list (CSR) is built if not provided.
+# Still allocated each step: the pair indices (to_pairs), the scatter of the 
+# lattice term (np.bincount, two per dimension), the obstacle term and, with 
+# lookup tables, the interpolated a_ij and phi_a.
+def compute_cmd_all(states_q, states_p, obstacles, walls, targets, targets_v, nbrs = None, params = None, out = None, work = None):
+    
+    # initialize 
+    if params is None:
+        params = default_params
+    if work is None:
+        work = workspace()
+    if nbrs is None:
+        nbrs = nbr_tools.neighbour_list(states_q, params.r)
+    nNodes = states_q.shape[1]
+    if out is None:
+        out = np.empty((3,nNodes))
+    i, j = nbr_tools.to_pairs(nbrs)
+    nPairs = len(j)
+    
+    # differences in position and velocity, for each pair
+    q_ij = work.get('q_ij', (3,nPairs))
+    p_ij = work.get('p_ij', (3,nPairs))
+    temp = work.get('temp', (3,nPairs))
+    np.take(states_q, j, axis = 1, out = q_ij)
+    np.subtract(q_ij, np.take(states_q, i, axis = 1, out = temp), out = q_ij)
+    np.take(states_p, j, axis = 1, out = p_ij)
+    np.subtract(p_ij, np.take(states_p, i, axis = 1, out = temp), out = p_ij)
+    
+    # sigma norm (z) and its gradient denominator (root), shared by all the terms below
+    root = work.get('root', (nPairs,))
+    z = work.get('z', (nPairs,))
+    np.einsum('ij,ij->j', q_ij, q_ij, out = root)
+    np.multiply(root, params.eps, out = root)
+    np.add(root, 1, out = root)
+    np.sqrt(root, out = root)
+    np.subtract(root, 1, out = z)
+    np.divide(z, params.eps, out = z)
+    
+    # adjacency (a_ij) and action function (phi_a = a_ij*phi(z - d_a)) for each pair
+    a = work.get('a', (nPairs,))
+    phi_a = work.get('phi_a', (nPairs,))
+    if params.lookup:
+        a[:] = params.a_ij(z)
+        phi_a[:] = params.phi_a(z)
+    else:
+        param_tools.rho_h(np.divide(z, params.r_a, out = a), params.h, out = a)
+        np.multiply(phi_into(z, params, phi_a, temp[0,:]), a, out = phi_a)
+    
+    # Lattice Flocking term (phi_alpha), antisymmetric in (i,j)
+    # ---------------------------------------------------------
+    np.divide(q_ij, root, out = temp)
+    np.multiply(temp, np.multiply(phi_a, params.c1_a, out = phi_a), out = temp)
+    np.multiply(p_ij, np.multiply(a, params.c2_a, out = a), out = p_ij)
+    np.add(temp, p_ij, out = temp)
+    for dim in range(3):
+        np.subtract(np.bincount(i, temp[dim,:], nNodes), np.bincount(j, temp[dim,:], nNodes), out = out[dim,:])
+    
+    # Obstacle Avoidance term (phi_beta)
+    # ----------------------------------
+    if obstacles.shape[1] + walls.shape[1] > 0:
+        np.add(out, compute_cmd_b_all(states_q, states_p, obstacles, walls, params), out = out)
+    
+    # Navigation term (phi_gamma)
+    # ---------------------------
+    q_it = work.get('q_it', (3,nNodes))
+    denom = work.get('denom', (3,nNodes))
+    np.subtract(states_q, targets, out = q_it)
+    np.multiply(q_it, q_it, out = denom)
+    np.add(denom, 1, out = denom)
+    np.sqrt(denom, out = denom)
+    np.divide(q_it, denom, out = q_it)
+    np.multiply(q_it, params.c1_g, out = q_it)
+    np.subtract(out, q_it, out = out)
+    np.subtract(states_p, targets_v, out = q_it)
+    np.multiply(q_it, params.c2_g, out = q_it)
+    np.subtract(out, q_it, out = out)
+    
+    return out
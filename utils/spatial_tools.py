@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module implements a spatial index (uniform grid, or "cell list")
+
+The space is hashed into cubic cells, nominally sized to the interaction
+radius, so that neighbours of an agent can only be in the same or adjacent
+cells. For large, spread-out swarms this makes neighbour discovery near-linear.
+
+Usage:
+
+    index = grid(r)                     # cell size (nominally, the interaction radius)
+    index.build(states_q)               # (re)build each step, states_q is 3 x N
+    i, j = index.pairs_within(r)        # all pairs (i < j) closer than r
+    k = index.query(point, r)           # all agents closer than r to a point
+
+@author: tjards
+"""
+
+import numpy as np
+
+#%% Useful functions
+# ------------------
+
+# offsets to cells within m cells (each unordered pair of cells only once)
+def half_stencil(m):
+    span = np.arange(-m, m+1)
+    offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1,3)
+    # keep the lexicographically positive half (and the cell itself)
+    keep = (offsets[:,0] > 0) | ((offsets[:,0] == 0) & (offsets[:,1] > 0)) | ((offsets[:,0] == 0) & (offsets[:,1] == 0) & (offsets[:,2] >= 0))
+    return offsets[keep]
+
+# expand [start, start+count) ranges into one flat array of indices
+def expand_ranges(starts, counts):
+    total = np.sum(counts)
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(total)
+
+
+#%% Uniform grid
+# --------------
+
+class grid:
+
+    # initializes an (empty) grid with cells of a given size
+    def __init__(self, cell_size):
+
+        self.cell_size  = cell_size
+        self.nNodes     = 0
+        self.points     = np.zeros((3,0))
+
+    # hash points into cells (linear key), relative to the grid origin
+    def hash_cells(self, cells):
+        cells = cells - self.origin
+        return (cells[0,:]*self.dims[1] + cells[1,:])*self.dims[2] + cells[2,:]
+
+    # (re)build the grid from the current positions (3 x N)
+    def build(self, points):
+
+        self.points = points
+        self.nNodes = points.shape[1]
+
+        # which cell is each point in
+        self.cells  = np.floor(points/self.cell_size).astype(np.int64)
+
+        # pad the grid by one cell, so offsets never wrap around
+        if self.nNodes > 0:
+            self.origin = np.min(self.cells, axis=1, keepdims=True) - 1
+            self.dims   = np.max(self.cells, axis=1) - self.origin.ravel() + 2
+        else:
+            self.origin = np.zeros((3,1), dtype=np.int64)
+            self.dims   = np.ones(3, dtype=np.int64)
+
+        # sort the points by cell, then store where each occupied cell starts
+        keys            = self.hash_cells(self.cells)
+        self.order      = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+
+    # find the (sorted) agents in cells given by keys, for each key
+    def lookup(self, keys):
+        starts = np.zeros(keys.shape, dtype=np.int64)
+        counts = np.zeros(keys.shape, dtype=np.int64)
+        if len(self.keys) > 0:
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys)-1)
+            found = self.keys[pos] == keys
+            starts[found] = self.starts[pos[found]]
+            counts[found] = self.counts[pos[found]]
+        return starts, counts
+
+    # all pairs (i < j) closer than r
+    def pairs_within(self, r):
+
+        m = int(np.ceil(r/self.cell_size))
+        i_all = []
+        j_all = []
+
+        # search the neighbouring cells (half of them, so each pair only comes up once)
+        for offset in half_stencil(m):
+
+            # the cell at this offset from each agent (if it is on the grid)
+            cells_j = self.cells + offset.reshape(3,1)
+            on_grid = np.all((cells_j >= self.origin) & (cells_j < self.origin + self.dims.reshape(3,1)), axis=0)
+            starts, counts = self.lookup(self.hash_cells(cells_j))
+            counts[~on_grid] = 0
+
+            # candidate pairs
+            i = np.repeat(np.arange(self.nNodes), counts)
+            j = self.order[expand_ranges(starts, counts)]
+
+            # within the same cell, only count each pair once
+            if not offset.any():
+                keep = i < j
+                i, j = i[keep], j[keep]
+
+            # keep those actually in range
+            dist = np.sqrt(np.sum((self.points[:,j]-self.points[:,i])**2, axis=0))
+            in_range = dist < r
+            i_all.append(i[in_range])
+            j_all.append(j[in_range])
+
+        i = np.concatenate(i_all)
+        j = np.concatenate(j_all)
+
+        # order each pair (i < j), then sort by i (then j)
+        i, j = np.minimum(i,j), np.maximum(i,j)
+        sort = np.lexsort((j,i))
+
+        return i[sort], j[sort]
+
+    # all agents closer than r to a point (3,)
+    def query(self, point, r):
+
+        m = int(np.ceil(r/self.cell_size))
+        span = np.arange(-m, m+1)
+        offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=0).reshape(3,-1)
+
+        # the cells around this point
+        cell = np.floor(np.reshape(point,(3,1))/self.cell_size).astype(np.int64)
+        cells = np.clip(cell + offsets, self.origin, self.origin + self.dims.reshape(3,1) - 1)
+        starts, counts = self.lookup(np.unique(self.hash_cells(cells)))
+
+        # keep those actually in range
+        k = self.order[expand_ranges(starts, counts)]
+        dist = np.sqrt(np.sum((self.points[:,k]-np.reshape(point,(3,1)))**2, axis=0))
+
+        return np.sort(k[dist < r])
@@ -10,6 +10,8 @@ This program implements Reynolds Rules of Flocking ("boids")
 """
 
 import numpy as np
+from scipy.spatial import cKDTree
+from utils import octree_tools
 
 # Hyperparameters
 # ----------------
@@ -36,6 +38,16 @@ C_c         = 0.35          # critical centrality below which member is interior
 alpha       = 0.5           # default: 0.5, between 0 and 1. modulates how tightly swarms converges into target. 0 is very loose, 1 is very tight 
 eps         = 0.00001       # to stop divides by zero
 
+topology    = 'nearest'     # how to select the n_c agents to pay attention to 
+                                # index = first ones found (in index order), nearest = nearest ones (KD-tree)
+far_field   = 'exact'       # how to sum the centrality (out to 2*R_i) for the whole swarm 
+                                # exact = all agents in range (KD-tree), octree = Barnes-Hut octree, for very large flocks (see octree_tools)
+noise       = 'bias'        # random disturbances (neither touches the global random state)
+                                # bias = fixed for each agent (seeded by its index, as originally)
+                                # stream = fresh each step, from one stream for the whole swarm (see noise_streams)
+noise_seed  = 0             # seed for the noise streams 
+noise_block = 256           # number of steps of noise drawn at once (per refill)
+
 sigma       = np.sqrt(np.divide(np.square(r_sep-r_h),4.60517)) #std dev of the gaussion set, such that at that separation zone, near zero
 sigma_sqr   = np.square(sigma)
 
@@ -43,9 +55,16 @@ sigma_sqr   = np.square(sigma)
 # ---------------------
 
 # computes a unit vector in the direction of the agent velo (i.e. forward)
+# note: zero if the agent is at rest (no forward direction)
 def unit_vector_fwd(velos):
-    vector_out = np.divide(velos,np.linalg.norm(velos))
+    norm = np.linalg.norm(velos)
+    vector_out = np.divide(velos,norm,out=np.zeros(np.shape(velos)),where=norm>0)
     return vector_out     # output is a unit vector
+
+# unit vectors for each column (dims x N), zero where the norm is zero
+def unit_vectors(vectors):
+    norms = np.linalg.norm(vectors, axis=0)
+    return np.divide(vectors,norms,out=np.zeros(np.shape(vectors)),where=norms>0)
     
 # brings agent back to cruised speed, v_0 after deviating
 def to_cruise(m, tau, v_o, v_i, e_x):
@@ -64,6 +83,71 @@ def gaussian_set(d_ij,r_h, sigma):
     else:
         return np.exp(-np.divide(np.square(d_ij-r_h),sigma_sqr))
     
+# update the interaction ranges of all agents, if it's time (same as in compute_cmd)
+def update_interaction_all(params, Ts):
+    if params[0,0] == 0:
+        params[0,:] = 5         # interaction radius (initialize, for the first time)
+    params[2,:] += 1            # counter to update range (slower than sample time)
+    due = params[2,:] >= round(del_u/Ts,0)+1
+    params[0,due] = update_interaction(s,params[0,due],R_max,params[1,due],n_c)
+    params[2,due] = 0
+    return params
+
+# find the neighbours of all agents at once (KD-tree)
+#   - topological: the (up to) n_c agents within R_i (nearest, or first in index 
+#   order, see topology), as an N x ceil(n_c) array of indices, with a mask of 
+#   which ones are valid 
+#   - centrality: all agents within 2*R_i (in index order), in CSR form (indptr, indices)
+#   (if centrality is False, only those within R_i, and only if required for the topology)
+def find_neighbours(states_q, R_i, centrality = True):
+    
+    nNodes = states_q.shape[1]
+    k_top = int(np.ceil(n_c))   # the most agents that can fit under the topical range 
+    tree = cKDTree(states_q.transpose())
+    
+    # all agents within the centrality range (except itself)
+    if centrality:
+        cent = tree.query_ball_point(states_q.transpose(), r=2*R_i, return_sorted=True)
+    elif topology != 'nearest':
+        cent = tree.query_ball_point(states_q.transpose(), r=R_i, return_sorted=True)
+    else:
+        cent = [[]]*nNodes
+    counts = np.array([len(cent_i) for cent_i in cent], dtype=int)
+    indices = np.concatenate([np.asarray(cent_i, dtype=int) for cent_i in cent]) if nNodes > 0 else np.zeros(0, dtype=int)
+    rows = np.repeat(np.arange(nNodes), counts)
+    not_self = indices != rows
+    rows, indices = rows[not_self], indices[not_self]
+    indptr = np.zeros(nNodes+1, dtype=int)
+    np.cumsum(np.bincount(rows, minlength=nNodes), out=indptr[1:])
+    
+    if topology == 'nearest':
+    
+        # nearest agents (plus itself), then only those within each agent's own range
+        bound = np.nextafter(np.max(R_i, initial=0), np.inf)
+        dists, idx = tree.query(states_q.transpose(), k=k_top+1, distance_upper_bound=bound)
+        idx = idx.reshape(nNodes,-1)
+        dists = dists.reshape(nNodes,-1)
+        valid = (dists <= R_i.reshape(-1,1)) & (idx != np.arange(nNodes).reshape(-1,1))
+        # move the valid ones up front (keeping them sorted by distance)
+        order = np.argsort(~valid, axis=1, kind='stable')[:,0:k_top]
+        top_idx = np.take_along_axis(idx, order, axis=1)
+        top_valid = np.take_along_axis(valid, order, axis=1)
+        
+    else:
+        
+        # the first agents (in index order) within each agent's own range 
+        # note: these are a subset of the (sorted) centrality neighbours
+        dist = np.linalg.norm(states_q[:,indices]-states_q[:,rows], axis=0)
+        within = dist <= R_i[rows]
+        rank = np.cumsum(within) - np.repeat(np.concatenate(([0],np.cumsum(within)))[indptr[0:-1]], np.diff(indptr))
+        keep = within & (rank <= k_top)
+        top_idx = np.zeros((nNodes,k_top), dtype=int)
+        top_valid = np.zeros((nNodes,k_top), dtype=bool)
+        top_idx[rows[keep], rank[keep]-1] = indices[keep]
+        top_valid[rows[keep], rank[keep]-1] = True
+    
+    return (top_idx, top_valid), (indptr, indices)
+    
 # Compute commands for Starling Flocking
 # --------------------------------------
 
@@ -118,39 +202,39 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, params, Ts):
     # search through each neighbour
     # -----------------------------
     for k_neigh in range(states_q.shape[1]):
-        
+    
         # except for itself
         if k_node != k_neigh:
-             
+         
             # compute the euc distance between them
             dist = np.linalg.norm(states_q[:,k_neigh]-states_q[:,k_node])
             #blind spot?
-            
+        
             # if the neighbour is within the range for computing centrality
             if dist <= 2*R_i: #yes, centrality is measured in a bigger range
-            
+        
                 # increment the counter
                 n_counter_centrality += 1
-                
+            
                 # compute centrality
                 C_i += np.divide((states_q[:,k_neigh]-states_q[:,k_node]),dist)
-            
-                        
+        
+                    
             # if the neighhour is within the interaction range (add blind spot later)
             if dist <= R_i and n_counter < n_c:
-                
+            
                 # increment the counter
                 n_counter += 1
-                
+            
                 # compute the separation force
                 # ----------------------------
                 f_sep += gaussian_set(dist, r_h, sigma)*np.divide((states_q[:,k_neigh]-states_q[:,k_node]),dist) 
-            
+        
                 # compute the cohesion force 
                 # -------------------------- 
                 if dist > r_h:
                     f_coh += np.divide((states_q[:,k_neigh]-states_q[:,k_node]),dist)
-                    
+                
                 # compute the alignment force
                 # ---------------------------
                 f_ali += unit_vector_fwd(states_p[:,k_neigh])
@@ -165,7 +249,7 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, params, Ts):
     if n_counter > 0:
         u_sep = -m*np.divide(w_s,n_counter)*f_sep.reshape((3,1))
         u_coh = m*C_i*np.divide(w_c,n_counter)*f_coh.reshape((3,1))
-        u_ali = m*w_a*np.divide(f_ali,np.linalg.norm(f_ali)).reshape((3,1))
+        u_ali = m*w_a*unit_vector_fwd(f_ali.ravel()).reshape((3,1))
         
         
     # ROOSTING BEHAVIOURS
@@ -208,8 +292,9 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, params, Ts):
     # RANDOM VECTOR
     # ==============
     
-    np.random.seed(k_node)  # each node had its own unique noise (bias)
-    u_rand = m*w_rand*2*(np.random.rand(3,1)-0.5) # random is between -1 and 1
+    # each node had its own unique noise (bias)
+    # note: the per-node version always uses the bias (see noise)
+    u_rand = m*w_rand*2*(noise_bias(k_node+1)[:,k_node].reshape((3,1))-0.5) # random is between -1 and 1
     
     # CONSOLIDATION
     # =============
@@ -225,4 +310,172 @@ def compute_cmd(targets, centroid, states_q, states_p, k_node, params, Ts):
   
 
   
-    
\ No newline at end of file
+    
+
+# Compute commands for Starling Flocking (whole swarm)
+# ----------------------------------------------------
+
+# note: same as compute_cmd, but for all agents at once (returns 3 x N, and params)
+# note: the interaction ranges are updated here (i.e. no need for update_interaction_all)
+def compute_cmd_all(targets, centroid, states_q, states_p, params, Ts):
+    
+    nNodes = states_q.shape[1]
+    
+    # import parameters
+    # -----------------
+    params = update_interaction_all(params, Ts)
+    R_i = params[0,:]           # interaction range 
+    C_i = params[3,:]           # centrality (previous)
+    (top_idx, top_valid), (indptr, indices) = find_neighbours(states_q, R_i, far_field != 'octree')
+    
+    # unit vectors in the forward direction, for all agents
+    e_fwd = unit_vectors(states_p)
+    
+    # SOCIAL BEHAVIOURS
+    # =================
+    
+    # centrality (all agents within 2*R_i)
+    # note: as in compute_cmd, this starts from the previous (scalar) centrality
+    if far_field == 'octree':
+        # sum of unit vectors approximated far away (see octree_tools)
+        sums = octree_tools.octree(states_q).sums(states_q, np.nextafter(2*R_i, np.inf))
+        C_vec = C_i + sums['sum_unit']
+        n_counter_centrality = sums['count']
+    else:
+        rows = np.repeat(np.arange(nNodes), np.diff(indptr))
+        q_ij = states_q[:,indices] - states_q[:,rows]
+        u_ij = np.divide(q_ij,np.linalg.norm(q_ij, axis=0))
+        C_vec = C_i + np.array([np.bincount(rows, u_ij[dim,:], nNodes) for dim in range(3)]).reshape(3,nNodes)
+        n_counter_centrality = np.diff(indptr)
+    C_i = np.where(n_counter_centrality > 0, np.divide(np.linalg.norm(C_vec, axis=0),np.maximum(n_counter_centrality,1)), C_i)
+    
+    # topological neighbours (within R_i)
+    top_idx = np.where(top_valid, top_idx, 0)
+    n_counter = np.sum(top_valid, axis=1)
+    q_ij = states_q[:,top_idx] - states_q[:,:,np.newaxis]
+    dist = np.where(top_valid, np.linalg.norm(q_ij, axis=0), 1)
+    u_ij = np.divide(q_ij,dist)*top_valid
+    
+    # compute the separation force
+    # ----------------------------
+    gaussian = np.where(dist <= r_h, 1, np.exp(-np.divide(np.square(dist-r_h),sigma_sqr)))
+    f_sep = np.sum(gaussian*u_ij, axis=2)
+    
+    # compute the cohesion force 
+    # -------------------------- 
+    f_coh = np.sum(u_ij*(dist > r_h), axis=2)
+    
+    # compute the alignment force
+    # ---------------------------
+    f_ali = -e_fwd + np.sum(e_fwd[:,top_idx]*top_valid, axis=2)
+    
+    # compute consolidated commands 
+    u_sep = np.zeros((3,nNodes))
+    u_coh = np.zeros((3,nNodes))
+    u_ali = np.zeros((3,nNodes))
+    some = n_counter > 0
+    u_sep[:,some] = -m*np.divide(w_s,n_counter[some])*f_sep[:,some]
+    u_coh[:,some] = m*C_i[some]*np.divide(w_c,n_counter[some])*f_coh[:,some]
+    u_ali[:,some] = m*w_a*unit_vectors(f_ali[:,some])
+    
+    # ROOSTING BEHAVIOURS
+    # ===================
+    
+    # note: as in compute_cmd, this scales with the distance to the last agent searched
+    k_last = np.where(np.arange(nNodes) != nNodes-1, nNodes-1, nNodes-2)
+    dist_last = np.linalg.norm(states_q[:,k_last]-states_q, axis=0)
+    
+    # find the vector for the forward direction (2D)
+    unit_fwd_2D = unit_vectors(states_p[0:2,:])
+    
+    # rotate it 90 degrees inwards (counterclockwise first)
+    unit_bank_2D = np.array([-unit_fwd_2D[1,:],unit_fwd_2D[0,:]])
+    
+    # adjust the direction to be towards target
+    # if moves farther from target, switch the sign (clockwise rotation)
+    to_target_2D = targets[0:2,:] - states_q[0:2,:]
+    farther = np.linalg.norm(to_target_2D + unit_bank_2D, axis=0) >= np.linalg.norm(to_target_2D, axis=0)
+    unit_bank_2D[:,farther] = -unit_bank_2D[:,farther]
+    
+    # compute unit vector towards target
+    unit_to_target_2D = np.divide(to_target_2D,np.linalg.norm(to_target_2D, axis=0))
+    
+    # compute dot product of fwd and target direction (measure of how much it is pointing inwards)
+    proj_to_target_2D = np.sum(unit_fwd_2D*(-unit_to_target_2D), axis=0)
+    
+    # compute the horizontal roosting acceleration
+    sign = np.sign(proj_to_target_2D)
+    f_roost_h = np.divide(dist_last,1)*np.vstack((unit_bank_2D, np.zeros((1,nNodes))))*(sign*alpha + sign*(1-alpha)*proj_to_target_2D)
+    u_roost_h = -m*w_roost_h*f_roost_h
+    
+    # compute the vertical roosting acceleration
+    f_roost_v = np.zeros((3,nNodes))
+    f_roost_v[2,:] = targets[2,:] - states_q[2,:]
+    u_roost_v = m*w_roost_v*f_roost_v
+    
+    # RANDOM VECTOR
+    # ==============
+    if noise == 'stream':
+        u_rand = m*w_rand*2*(noise_stream(nNodes).draw()-0.5)
+    else:
+        u_rand = m*w_rand*2*(noise_bias(nNodes)-0.5) # random is between -1 and 1
+    
+    # CONSOLIDATION
+    # =============
+    
+    params[1,:] = n_counter
+    params[3,:] = C_i
+    
+    cmd = u_coh + u_ali + u_sep + u_roost_h + u_roost_v + u_rand
+    
+    return cmd, params
+
+# Noise (random disturbances)
+# ---------------------------
+
+# each node has its own unique noise (bias), seeded by its index (3 x N)
+# note: these do not change between steps, so they are only drawn once (with 
+# their own generators, so the global random state is left alone)
+noise_biases = np.zeros((3,0))
+def noise_bias(nNodes):
+    global noise_biases
+    if noise_biases.shape[1] < nNodes:
+        new = [np.random.RandomState(k_node).rand(3,1) for k_node in range(noise_biases.shape[1], nNodes)]
+        noise_biases = np.hstack([noise_biases] + new)
+    return noise_biases[:,0:nNodes]
+
+# fresh noise each step, from one stream for the whole swarm
+# note: the stream is refilled noise_block steps at a time (one draw for all agents), 
+# so a step is one slice; the noise is the same for a given seed and swarm size
+class noise_streams:
+    
+    def __init__(self, nNodes, seed = None, block = None):
+        self.nNodes = nNodes
+        self.seed   = noise_seed if seed is None else seed
+        self.block  = noise_block if block is None else block
+        self.rng    = np.random.default_rng(self.seed)
+        self.values = np.zeros((self.block,3,nNodes))
+        self.next   = self.block     # next step to use (refill when it reaches the end)
+    
+    # noise for all agents for this step (3 x N, uniform between 0 and 1)
+    def draw(self):
+        if self.next >= self.block:
+            self.rng.random(out = self.values)
+            self.next = 0
+        values = self.values[self.next]
+        self.next += 1
+        return values
+
+# stream for the whole swarm (persists between steps)
+# note: a new stream starts when the swarm size or noise_seed changes, or after reset_noise()
+noise_streams_all = None
+def noise_stream(nNodes):
+    global noise_streams_all
+    if noise_streams_all is None or noise_streams_all.nNodes != nNodes or noise_streams_all.seed != noise_seed:
+        noise_streams_all = noise_streams(nNodes)
+    return noise_streams_all
+
+# start the noise again (e.g. between runs)
+def reset_noise():
+    global noise_streams_all
+    noise_streams_all = None
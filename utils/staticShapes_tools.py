@@ -5,7 +5,7 @@ Created on Sun Jun 26 20:26:17 2022
 
 Static Shapes 
 
-Note: this is only sort of working and is very inefficient 
+Note: this is only sort of working (see trajectory_tools for the twist law) 
 
 
 
@@ -17,6 +17,7 @@ import pickle
 import matplotlib.pyplot as plt
 from utils import quaternions as quat
 from utils import encirclement_tools as encircle_tools
+from utils import trajectory_tools
 
 
 #%% Parameters
@@ -26,6 +27,11 @@ c1_d        = 2             # position (q)
 c2_d        = 2*np.sqrt(2)  # velocity (p)
 eps         = 0.1           # nominally 0.1
 lemni_type  = 3             # 0 = surv, 1 = rolling, 2 = mobbing, 3 = experimental  
+# twist laws, by lemni_type (see trajectory_tools)
+twist_laws  = {0: trajectory_tools.twist_lemni,
+               1: trajectory_tools.twist_rolling,
+               2: trajectory_tools.twist_mobbing,
+               3: trajectory_tools.twist_statics}
 
 # inherited from encirclement
 r_desired, phi_dot_d, ref_plane, quat_0 = encircle_tools.get_params() 
@@ -137,137 +143,27 @@ def compute_cmd(states_q, states_p, targets_enc, targets_v_enc, k_node):
     
     return u_enc[:,k_node]
 
+# all agents at once (3 x N)
+def compute_cmd_all(states_q, states_p, targets_enc, targets_v_enc):
+    
+    u_enc = - c1_d*sigma_1(states_q-targets_enc)-c2_d*(states_p - targets_v_enc)
+    
+    return u_enc
+
 #def lemni_target(nVeh,r_desired,lemni_type,lemni_all,state,targets,i,unit_lem,phi_dot_d,ref_plane,quat_0,t,twist_perp):
 def lemni_target(nVeh,lemni_all,state,targets,i,t):
     
-    # initialize the lemni twist factor
-    lemni = np.zeros([1, nVeh])
+    return lemni_step(state, targets, lemni_all[i-1,:], i, t)
+
+# trajectory for one step, from the last twist (see trajectory_tools.generator)
+def lemni_step(state, targets, last_twist, i, t, order = None):
     
     # if mobbing, offset targets up
     if lemni_type == 2:
         targets[2,:] += r_desired
 
-    # UNTWIST -  each agent has to be untwisted into a common plane
-    # -------------------------------------------------------------      
-    last_twist = lemni_all[i-1,:] #np.pi*lemni_all[i-1,:]
-    state_untwisted = state.copy()
-    
-    # for each agent 
-    for n in range(0,state.shape[1]):
-        
-        # get the last twist
-        untwist = last_twist[n]
-        # make a quaternion from it
-        untwist_quat = quat.quatjugate(quat.e2q(untwist*unit_lem.ravel()))
-        
-        # (un)TEST - try the un-rotate (see TEST below for forward rotate) - (pq)* = q*p* not p*q*
-        #untwist_quat= quat.quat_mult(untwist_quat,quat_0_)
-        # (un)TEST
-        
-        # pull out states
-        states_q_n = state[0:3,n]
-        # pull out the targets (for reference frame)
-        targets_n = targets[0:3,n] 
-        # untwist the agent 
-        state_untwisted[0:3,n] = quat.rotate(untwist_quat,states_q_n - targets_n) + targets_n  
-             
-    # ENCIRCLE -  form a common untwisted circle
-    # ------------------------------------------
-    
-    # compute the untwisted trejectory 
-    #targets_encircle, phi_dot_desired_i = encircle_tools.encircle_target(targets, state_untwisted, r_desired, phi_dot_d, ref_plane, quat_0)
-    targets_encircle, phi_dot_desired_i = encircle_tools.encircle_target(targets, state_untwisted)
-    
-    # TWIST - twist the circle
-    # ------------------------
+    # just give some time to form a circle first (no twist)
+    twist_law = twist_laws.get(lemni_type) if i > 0 else None
     
-    # for each agent, we define a unique twist 
-    for m in range(0,state.shape[1]):
- 
-        # pull out states/targets
-        states_q_i = state[0:3,m]
-        targets_i = targets[0:3,m]
-        target_encircle_i = targets_encircle[0:3,m]
-        
-        # get the vector of agent position wrt target
-        state_m_shifted = states_q_i - targets_i
-        target_encircle_shifted = target_encircle_i - targets_i
-        
-        # compute and store the lemniscate twist factor (tried a bunch of ways to do this)   
-        #m_r = np.sqrt(state_untwisted[0,m]**2 + state_untwisted[1,m]**2)
-        #m_theta = np.arctan2(state_untwisted[1,m],state_untwisted[0,m]) 
-        #m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-        
-        # just give some time to form a circle first
-        if i > 0:
-            
-            # compute the lemni factor
-            # -----------------------
-            
-            # if lemni_type == 0:
-            #     # compute and store the lemniscate twist factor (tried a bunch of ways to do this)   
-            #     m_r = np.sqrt(state_untwisted[0,m]**2 + state_untwisted[1,m]**2)
-            #     m_theta = np.arctan2(state_untwisted[1,m],state_untwisted[0,m]) 
-            #     m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-            #     lemni[0,m] = m_theta
-            
-            # lemniscate
-            if lemni_type == 0: # travis: this or above - come back and figure out which of these is correct :(
-                # compute and store the lemniscate twist factor (tried a bunch of ways to do this)
-                m_r = np.sqrt((state_untwisted[0,m]-targets[0,m])**2 + (state_untwisted[1,m]-targets[1,m])**2)
-                m_theta = np.arctan2(state_untwisted[1,m]-targets[1,m],state_untwisted[0,m]-targets[0,m]) 
-                m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-                lemni[0,m] = m_theta    
-            
-            # shifting lemninscate    
-            if lemni_type == 1: 
-                # compute and store the lemniscate twist factor (tried a bunch of ways to do this)
-                #m_r = np.sqrt((state_untwisted[0,m]-targets[0,m])**2 + (state_untwisted[1,m]-targets[1,m])**2)
-                m_theta = np.arctan2(state_untwisted[1,m]-targets[1,m],state_untwisted[0,m]-targets[0,m]) 
-                m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-                m_shift = - np.pi + 0.1*t
-                lemni[0,m] = m_theta + m_shift
-                
-            # mobbing    
-            if lemni_type == 2: 
-                # compute and store the lemniscate twist factor (tried a bunch of ways to do this)
-                m_r = np.sqrt((state_untwisted[0,m]-targets[0,m])**2 + (state_untwisted[1,m]-targets[1,m])**2)
-                m_theta = np.arctan2(state_untwisted[1,m]-targets[1,m],state_untwisted[0,m]-targets[0,m]) 
-                m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-                lemni[0,m] = m_theta - np.pi 
-                
-            # experimental 
-            if lemni_type == 3:
-                
-                m_r = np.sqrt((state_untwisted[0,m]-targets[0,m])**2 + (state_untwisted[1,m]-targets[1,m])**2)
-                m_theta = np.arctan2(state_untwisted[1,m]-targets[1,m],state_untwisted[0,m]-targets[0,m]) 
-                m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
-                
-                if m_theta > np.pi:
-                    lemni[0,m] = np.pi/2 
-                else:
-                    lemni[0,m] = 0
-                
-                
-                
-
-        # twist the trajectory position and load it
-        twist = lemni[0,m] #np.pi*lemni[0,m]
-        twist_quat = quat.e2q(twist*unit_lem.ravel())
-        
-        # TEST - take the quaternion product to also rotate by quat_0
-        #twist_quat = quat.quat_mult(quat_0,twist_quat)
-        # TEST -
-        
-        twist_pos = quat.rotate(twist_quat,target_encircle_shifted)+targets_i  
-        targets_encircle[0:3,m] = twist_pos
-                  
-        # twist the trajectory velocity and load it
-        w_vector = phi_dot_desired_i[0,m]*twist_perp                        # pretwisted
-        w_vector_twisted = quat.rotate(twist_quat,w_vector)                 # twisted 
-        twist_v_vector = np.cross(w_vector_twisted.ravel(),state_m_shifted)
-        targets_encircle[3,m] =  - twist_v_vector[0] 
-        targets_encircle[4,m] =  - twist_v_vector[1] 
-        targets_encircle[5,m] =  - twist_v_vector[2]     
-
-    return targets_encircle, lemni
+    # untwist, encircle and twist (all agents at once)
+    return trajectory_tools.twist_target(state, targets, last_twist, twist_law, t, unit_lem, twist_perp, order)
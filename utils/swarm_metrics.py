@@ -9,7 +9,7 @@ This program computes some useful swarm metrics
 """
 
 import numpy as np
-from scipy.spatial.distance import cdist
+from scipy.spatial.distance import cdist, pdist
 
 
 
@@ -79,7 +79,8 @@ def spacing(states_q):
     # visibility radius
     radius = 1.5*5
     
-    seps=cdist(states_q.transpose(), states_q.transpose())    
+    # note: the mean of all separations needs every pair, so we compute each pair once
+    seps=pdist(states_q.transpose())    
     vals = np.unique(seps[np.where(seps!=0)])
     vals_t = vals # even those out of range
     vals = np.unique(vals[np.where(vals<radius)])
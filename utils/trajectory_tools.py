@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module implements the twisted encirclement trajectories shared by the
+lemniscates (lemni_tools) and the static shapes (staticShapes_tools)
+
+For all agents at once, the trajectory is found in three steps:
+
+    - UNTWIST: rotate each agent (about unit_lem) by minus its last twist
+    - ENCIRCLE: form a common untwisted circle (encirclement_tools)
+    - TWIST: rotate each agent's target (position and velocity) by its new twist
+
+The shapes only differ by their twist law, which gives the twist of each agent
+from its untwisted angle around the target (theta, in [0, 2pi)) and time (t):
+
+    twist = twist_law(theta, t)     # theta is (N,), returns (N,)
+
+Each tactic picks its twist laws (by lemni_type), so new shapes only need a 
+new twist law.
+
+@author: tjards
+"""
+
+import numpy as np
+from utils import quaternions as quat
+from utils import encirclement_tools as encircle_tools
+
+#%% Twist laws
+# ------------
+
+# lemniscate
+def twist_lemni(theta, t):
+    return theta
+
+# shifting (rolling) lemniscate
+def twist_rolling(theta, t):
+    return theta - np.pi + 0.1*t
+
+# mobbing
+def twist_mobbing(theta, t):
+    return theta - np.pi
+
+# static shape (experimental)
+def twist_statics(theta, t):
+    return np.where(theta > np.pi, np.pi/2, 0)
+
+#%% Trajectory engine
+# -------------------
+
+# twisted encirclement targets (and the new twists), for all agents
+#   - last_twist is (N,), the twists from the last step
+#   - twist_law = None leaves the circle untwisted (e.g. while it forms)
+#   - order is the angular_order to update (see encirclement_tools)
+def twist_target(state, targets, last_twist, twist_law, t, unit_lem, twist_perp, order = None):
+
+    # initialize the twist factor
+    lemni = np.zeros([1, state.shape[1]])
+
+    # UNTWIST -  each agent has to be untwisted into a common plane
+    # -------------------------------------------------------------
+    # note: one quaternion per agent (as columns)
+    untwist_quat = quat.quatjugate(quat.e2q(unit_lem*last_twist))
+    state_untwisted = state.copy()
+    state_untwisted[0:3,:] = quat.rotate_each(untwist_quat, state[0:3,:] - targets[0:3,:]) + targets[0:3,:]
+
+    # ENCIRCLE -  form a common untwisted circle
+    # ------------------------------------------
+    targets_encircle, phi_dot_desired_i = encircle_tools.encircle_target(targets, state_untwisted, order)
+
+    # TWIST - twist the circle
+    # ------------------------
+
+    # get the vectors of agent positions wrt targets
+    state_shifted = state[0:3,:] - targets[0:3,:]
+    target_encircle_shifted = targets_encircle[0:3,:] - targets[0:3,:]
+
+    # compute the twist (for each agent, a unique twist)
+    if twist_law is not None:
+        m_theta = np.arctan2(state_untwisted[1,:]-targets[1,:],state_untwisted[0,:]-targets[0,:])
+        m_theta = np.mod(m_theta, 2*np.pi)  #convert to 0 to 2Pi
+        lemni[0,:] = twist_law(m_theta, t)
+
+    # twist the trajectory position and load it
+    twist_quat = quat.e2q(unit_lem*lemni[0,:])
+    targets_encircle[0:3,:] = quat.rotate_each(twist_quat, target_encircle_shifted) + targets[0:3,:]
+
+    # twist the trajectory velocity and load it
+    w_vector = phi_dot_desired_i[0,:]*twist_perp                        # pretwisted
+    w_vector_twisted = quat.rotate_each(twist_quat, w_vector)           # twisted
+    twist_v_vector = np.cross(w_vector_twisted, state_shifted, axis=0)
+    targets_encircle[3:6,:] = - twist_v_vector
+
+    return targets_encircle, lemni
+
+#%% Trajectory generators
+# -----------------------
+
+class generator:
+    
+    # step_function(state, targets, last_twist, i, t, order) returns the trajectory 
+    # and the new twist (e.g. encirclement_tools.circle_step, lemni_tools.lemni_step)
+    def __init__(self, step_function, nVeh):
+        
+        self.step_function  = step_function
+        self.i              = 0                                 # number of steps
+        self.lemni          = np.zeros([1, nVeh])               # twist from the last step
+        self.order          = encircle_tools.angular_order()    # angular order from the last step
+        
+    # trajectory for the next step
+    def step(self, state, targets, t):
+        
+        self.i += 1
+        trajectory, self.lemni = self.step_function(state, targets, self.lemni[0,:], self.i, t, self.order)
+        
+        return trajectory, self.lemni